@@ -5,4 +5,11 @@ from .abc import *
 from .static_data import *
 from .errors import *
 from .query_engine import BaseballQueryClient
+from .cache_manager import ConstantsCache, ResultCache
 from .sql_query import SQLQuery, BaseStrSQLQuery
+from .instrumentation import FetchStats
+from .query_log import SlowQueryLog
+from .admission import AdmissionController
+from .sqlite_db import SQLiteDBManager, export_sqlite
+from .plays_store import PlaysStore, export_plays_store
+from .rollups import RollupManager
@@ -1,6 +1,9 @@
+import copy
 import pandas as pd
 from typing import *
 from abc import ABC, abstractmethod
+from .frames import frame_from_records
+from .instrumentation import FetchStats, NULL_STATS
 
 class DBMetric:
     """Represents metadata for a metric stored in the database."""
@@ -16,11 +19,30 @@ class DBMetric:
         self.is_python = data.get('is_python', 0)
         self.metric_description = data.get('metric_description')
         self.hidden = data.get('hidden', 0)
+        # The column may be summed per player and day and re-summed over any date range
+        self.is_additive = data.get('is_additive', 0)
         self.dependencies = []
         dependencies = data.get('dependencies', '')
         if dependencies:
             self.dependencies = dependencies.split(',')
 
+    def to_dict(self) -> Dict:
+        """Inverse of the constructor, the row of the metrics table."""
+        return {
+            'metric_name': self.metric_name,
+            'sql_value': self.sql_value,
+            'is_all_plays': self.is_all_plays,
+            'is_totals_batter': self.is_totals_batter,
+            'is_totals_pitcher': self.is_totals_pitcher,
+            'is_totals_fielder': self.is_totals_fielder,
+            'is_grouping': self.is_grouping,
+            'is_python': self.is_python,
+            'metric_description': self.metric_description,
+            'hidden': self.hidden,
+            'is_additive': self.is_additive,
+            'dependencies': ','.join(self.dependencies)
+        }
+
     def __repr__(self):
         return (
             f"Metric(metric_name='{self.metric_name}', sql_value='{self.sql_value}', "
@@ -30,6 +52,14 @@ class DBMetric:
             f"hidden={self.hidden}, dependencies='{self.dependencies}')"
         )
 
+class ColumnInfo(NamedTuple):
+    """A column of one of the stats tables."""
+
+    table: str
+    column: str
+    data_type: str
+
+
 class BaseQueryBuilder(ABC):
     """Abstract builder for assembling SQL queries."""
 
@@ -91,6 +121,9 @@ class BaseQueryBuilder(ABC):
     def get_order_columns(self) -> List[str]:
         return self.order_columns
 
+    def copy(self) -> Self:
+        return copy.deepcopy(self)
+
     def __str__(self) -> str:
         return self.get_query()
 
@@ -109,10 +142,48 @@ class BaseDBManager(ABC):
     async def fetch_all(self, query: str, params: Optional[Tuple | Dict | List] = None) -> List[Dict]:
         pass
 
+    async def fetch_table_schema(self, tables: Sequence[str]) -> List[Dict]:
+        """Columns of ``tables`` with their data type, in a single query."""
+        placeholders = ', '.join(['%s'] * len(tables))
+        query = ('SELECT table_name AS table_name, column_name AS column_name, data_type AS data_type '
+                 'FROM information_schema.columns '
+                 f'WHERE table_schema = DATABASE() AND table_name IN ({placeholders}) '
+                 'ORDER BY table_name, ordinal_position')
+        return await self.fetch_all(query, list(tables))
+
+    async def get_table_checksum(self, table: str) -> Any:
+        """Cheap version probe of a table, changes whenever its content changes."""
+        rows = await self.fetch_all(f'CHECKSUM TABLE {table}')
+        return rows[0]['Checksum'] if rows else None
+
+    async def fetch_frame(self, query: str, params: Optional[Tuple | Dict | List] = None,
+                          dtypes: Optional[Dict[str, str]] = None, stats: FetchStats = NULL_STATS) -> pd.DataFrame:
+        """Fetch the result directly as a DataFrame."""
+        with stats.stage('sql_execute'):
+            data = await self.fetch_all(query, params)
+        with stats.stage('frame_build'):
+            return frame_from_records(data, dtypes)
+
+    async def iter_chunks(self, query: str, params: Optional[Tuple | Dict | List] = None, chunk_size: int = 10000,
+                          dtypes: Optional[Dict[str, str]] = None) -> AsyncIterator[pd.DataFrame]:
+        """Yield the result in DataFrames of at most ``chunk_size`` rows."""
+        data = await self.fetch_all(query, params)
+        for start in range(0, len(data), chunk_size):
+            yield frame_from_records(data[start:start + chunk_size], dtypes)
+
+    def is_in_flight(self, query: str, params: Optional[Tuple | Dict | List] = None,
+                     dtypes: Optional[Dict[str, str]] = None) -> bool:
+        """Whether fetch_frame would join an identical fetch that is already running instead of executing."""
+        return False
+
     @abstractmethod
     async def execute_update(self, query: str, params: Optional[Tuple | Dict | List] = None) -> int:
         pass
 
+    async def execute_transaction(self, statements: Sequence[Tuple[str, Optional[Tuple | Dict | List]]]) -> List[int]:
+        """Run the (query, params) statements in one transaction. Returns the row count of each."""
+        raise NotImplementedError(f'{type(self).__name__} does not support transactions')
+
     @abstractmethod
     async def close(self):
         pass
@@ -135,6 +206,10 @@ class BaseCache(ABC):
     def get_cache_entry(self, key: str) -> Any | None:
         pass
 
+    @abstractmethod
+    def refresh(self, key: Optional[str] = None):
+        pass
+
     @abstractmethod
     async def get_totals_batter(self) -> List[str]:
         pass
@@ -163,6 +238,18 @@ class BaseCache(ABC):
     async def get_table_columns_dict(self):
         pass
 
+    @abstractmethod
+    async def get_column_index(self) -> Dict[str, Tuple[ColumnInfo, ...]]:
+        pass
+
+    @abstractmethod
+    async def get_batted_ball_probabilities(self) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def load_snapshot(self) -> bool:
+        pass
+
 
 BuilderT = TypeVar('BuilderT', bound=BaseQueryBuilder)
 
@@ -171,6 +258,8 @@ class BaseQueryFactory(ABC):
 
     db_manager: BaseDBManager = None
     cache = None
+    # Optional AdmissionController gating the DB work of every query
+    admission = None
 
     @abstractmethod
     async def initialize(self):
@@ -186,7 +275,13 @@ class BaseQueryFactory(ABC):
         pass
 
     @abstractmethod
-    async def fetch_data(self, query_builder: BuilderT, skip_processor: bool = False) -> pd.DataFrame:
+    async def fetch_data(self, query_builder: BuilderT, skip_processor: bool = False,
+                         batched: bool = False) -> pd.DataFrame:
+        pass
+
+    @abstractmethod
+    def stream_data(self, query_builder: BuilderT, chunk_size: int = 10000,
+                    skip_processor: bool = False) -> AsyncIterator[pd.DataFrame]:
         pass
 
 class VectorizedMetric(ABC):
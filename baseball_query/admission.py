@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, nullcontext
+from typing import *
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+T = TypeVar('T')
+
+
+def admitted(admission: Optional['AdmissionController'], lane: str = BACKGROUND) -> AsyncContextManager:
+    """``admission.slot(lane)``, a no-op without a controller."""
+    return nullcontext() if admission is None else admission.slot(lane)
+
+
+async def run_admitted(admission: Optional['AdmissionController'], lane: str, work: Callable[[], Awaitable[T]],
+                       joining: Callable[[], bool]) -> T:
+    """
+    Await ``work()`` in a slot of ``lane``, directly without a controller.
+    :param joining: Whether ``work`` would join identical work in flight, which holds the slot doing it. Checked
+        before queueing and again once admitted, a joiner hands its slot back and runs without one.
+    """
+    if admission is not None:
+        while not joining():
+            async with admission.slot(lane):
+                if not joining():
+                    return await work()
+    return await work()
+
+
+class AdmissionController:
+    """
+    Limits the in-flight DB work of a client, admitting waiters by lane priority.
+    Client queries take an INTERACTIVE slot. Plays queries, metadata loads, rollup maintenance and the exports
+    given the controller take a BACKGROUND slot. Fetches coalesced into an identical one in flight take none.
+    Calls made on the DBManager directly, e.g. get_combined_data, are not admitted. A slot is never requested while holding one, so a limit of 1 can't deadlock.
+    """
+
+    def __init__(self, limit: int = 10, lanes: Sequence[str] = (INTERACTIVE, BACKGROUND), reserved: int = 1):
+        """
+        :param limit: Queries allowed in flight at once, normally the connection pool size.
+        :param lanes: Lane names, highest priority first. A free slot goes to the oldest waiter of the first
+            lane that has one.
+        :param reserved: Slots only the first lane may use, so its requests never queue behind a full
+            lower-priority lane.
+        """
+        if limit < 1:
+            raise ValueError('limit must be at least 1')
+        self.limit = limit
+        self.lanes = tuple(lanes)
+        self.reserved = min(reserved, limit - 1)
+        self.active = 0
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in self.lanes}
+        self.admitted = {lane: 0 for lane in self.lanes}
+        self.wait_time = {lane: 0.0 for lane in self.lanes}
+        self.max_wait = {lane: 0.0 for lane in self.lanes}
+
+    def _lane_limit(self, lane: str) -> int:
+        return self.limit if lane == self.lanes[0] else self.limit - self.reserved
+
+    def _can_admit(self, lane: str) -> bool:
+        if self.active >= self._lane_limit(lane):
+            return False
+        # Earlier waiters of this or a higher priority lane go first
+        for other in self.lanes:
+            if self.waiters[other]:
+                return False
+            if other == lane:
+                return True
+        return True
+
+    async def acquire(self, lane: str = INTERACTIVE):
+        if lane not in self.waiters:
+            raise ValueError(f'Unknown lane: {lane}')
+        start = time.perf_counter()
+        if not self._can_admit(lane):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters[lane].append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over right before the cancellation, pass it on
+                    self.release()
+                elif waiter in self.waiters[lane]:
+                    # _wake drops waiters cancelled before it reached them
+                    self.waiters[lane].remove(waiter)
+                raise
+        else:
+            self.active += 1
+        waited = time.perf_counter() - start
+        self.admitted[lane] += 1
+        self.wait_time[lane] += waited
+        self.max_wait[lane] = max(self.max_wait[lane], waited)
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        for lane in self.lanes:
+            queue = self.waiters[lane]
+            while queue and self.active < self._lane_limit(lane):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                # The slot is handed over directly so a newcomer can't take it first
+                self.active += 1
+                waiter.set_result(None)
+            if queue:
+                # Lower lanes wait until this one is drained
+                return
+
+    @asynccontextmanager
+    async def slot(self, lane: str = INTERACTIVE):
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def queue_depth(self, lane: str = None) -> int:
+        if lane is not None:
+            return len(self.waiters[lane])
+        return sum(len(queue) for queue in self.waiters.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'lanes': {
+                lane: {
+                    'queued': len(self.waiters[lane]),
+                    'admitted': self.admitted[lane],
+                    'wait_time': self.wait_time[lane],
+                    'avg_wait': self.wait_time[lane] / self.admitted[lane] if self.admitted[lane] else 0.0,
+                    'max_wait': self.max_wait[lane]
+                } for lane in self.lanes
+            }
+        }
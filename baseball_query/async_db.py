@@ -1,10 +1,19 @@
 import aiomysql
+import asyncio
+import itertools
 import os
+import time
+import weakref
 import pandas as pd
+from collections import OrderedDict
 from typing import *
 from .errors import QueryExecutionError, EmptyQueryError
 from .queries import SingleQueryBuilder
-from .abc import BaseDBManager
+from .sql_query import to_prepared_sql
+from .abc import BaseDBManager, BaseQueryBuilder
+from .frames import frame_from_columns, check_unique_columns
+from .instrumentation import FetchStats, NULL_STATS
+from .query_log import SlowQueryLog
 
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
@@ -14,17 +23,42 @@ DB_CONFIG = {
     'charset': os.getenv('DB_CHARSET', 'utf8mb4')
 }
 
-
 class DBManager(BaseDBManager):
     """Async MySQL manager for executing baseball queries."""
 
-    def __init__(self, db_config: Dict[str, str] = None, pool_size: int = 10):
+    def __init__(self, db_config: Dict[str, str] = None, pool_size: int = 10, prepared_statements: bool = False,
+                 prepare_threshold: int = 2, max_prepared_statements: int = 64, slow_query_log: SlowQueryLog = None,
+                 coalesce: bool = False):
+        """
+        :param prepared_statements: Run repeated query templates as server-side prepared statements.
+            A parameterized execution takes two round trips, SET of the parameters and EXECUTE, so it only
+            pays off for statements whose parse and plan cost more than a round trip, e.g. long metric SQL.
+        :param prepare_threshold: Executions of the same SQL text before it gets prepared.
+        :param max_prepared_statements: Prepared statements kept per connection, least recently used are deallocated.
+        :param slow_query_log: Records the fetches slower than its threshold.
+        :param coalesce: Let identical concurrent fetches share one execution, can be overridden per call.
+        """
         if db_config is None:
             self.db_config = DB_CONFIG
         else:
             self.db_config = db_config
         self.pool = None
         self.pool_size = pool_size
+        self.prepared_statements = prepared_statements
+        self.prepare_threshold = prepare_threshold
+        self.max_prepared_statements = max_prepared_statements
+        self.template_counts: Dict[str, int] = {}
+        self.unpreparable: Set[str] = set()
+        # connection -> SQL text -> statement name, in LRU order
+        self.statements: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.statement_ids = itertools.count()
+        self.slow_query_log = slow_query_log
+        self.coalesce = coalesce
+        # key -> [shared fetch, callers that joined it]
+        self.in_flight: Dict[Tuple, List] = {}
+        self.coalesced_hits = 0
+        # EXPLAIN tasks of the slow query log
+        self.background_tasks: Set[asyncio.Task] = set()
 
     async def initialize_pool(self):
         if self.pool is None:
@@ -38,15 +72,200 @@ class DBManager(BaseDBManager):
                 maxsize=self.pool_size
             )
 
-    async def fetch_all(self, query: str, params: Tuple | Dict | List = None) -> List[Dict]:
+    async def fetch_all(self, query: str, params: Tuple | Dict | List = None, coalesce: bool = None) -> List[Dict]:
+        """:param coalesce: Overrides the manager's coalesce setting for this call."""
+        key = self._coalesce_key(coalesce, 'all', query, params)
+        if key is None:
+            return await self._fetch_all(query, params)
+        return await self._coalesced(key, lambda: self._fetch_all(query, params),
+                                     lambda rows: [dict(row) for row in rows])
+
+    async def _fetch_all(self, query: str, params: Tuple | Dict | List = None) -> List[Dict]:
         await self.initialize_pool()
         async with self.pool.acquire() as connection:
             async with connection.cursor(aiomysql.DictCursor) as cursor:
+                start = time.perf_counter()
+                try:
+                    await self._execute(connection, cursor, query, params)
+                    rows = await cursor.fetchall()
+                except Exception as e:
+                    raise QueryExecutionError(message=str(e), query1=query)
+        self._log_query(query, params, time.perf_counter() - start, len(rows))
+        return rows
+
+    async def _execute(self, connection, cursor, query: str, params: Tuple | Dict | List = None):
+        """Execute directly, or through a prepared statement once the template repeats."""
+        statement = None
+        if self._should_prepare(query, params):
+            statement = await self._prepare(connection, cursor, query)
+        if statement is None:
+            await cursor.execute(query, params)
+        elif params:
+            variables = [f'@bq_p{i}' for i in range(len(params))]
+            # Separate statements, multi-statement connections would let an identifier in the builders' SQL
+            # text smuggle in a second statement
+            await cursor.execute(f'SET {", ".join(v + " = %s" for v in variables)}', params)
+            await cursor.execute(f'EXECUTE {statement} USING {", ".join(variables)}')
+        else:
+            await cursor.execute(f'EXECUTE {statement}')
+
+    def _should_prepare(self, query: str, params: Tuple | Dict | List = None) -> bool:
+        if not self.prepared_statements or isinstance(params, dict) or query in self.unpreparable:
+            return False
+        if len(self.template_counts) > 4096 and query not in self.template_counts:
+            self.template_counts.clear()
+        count = self.template_counts.get(query, 0) + 1
+        self.template_counts[query] = count
+        return count >= self.prepare_threshold
+
+    async def _prepare(self, connection, cursor, query: str) -> str | None:
+        statements = self.statements.get(connection)
+        if statements is None:
+            statements = self.statements[connection] = OrderedDict()
+        if query in statements:
+            statements.move_to_end(query)
+            return statements[query]
+        if len(statements) >= self.max_prepared_statements:
+            _, oldest = statements.popitem(last=False)
+            await cursor.execute(f'DEALLOCATE PREPARE {oldest}')
+        name = f'bq_stmt_{next(self.statement_ids)}'
+        try:
+            await cursor.execute(f'PREPARE {name} FROM %s', (to_prepared_sql(query),))
+        except Exception:
+            # Not every statement can be prepared, run it as plain SQL from now on
+            self.unpreparable.add(query)
+            return None
+        statements[query] = name
+        return name
+
+    async def fetch_frame(self, query: str, params: Tuple | Dict | List = None, dtypes: Dict[str, str] = None,
+                          stats: FetchStats = NULL_STATS, coalesce: bool = None) -> pd.DataFrame:
+        """
+        Columnar fetch: rows come back as tuples and are transposed into per-column lists,
+        skipping the per-row dicts built by fetch_all.
+        :param coalesce: Overrides the manager's coalesce setting for this call.
+        """
+        key = self._coalesce_key(coalesce, 'frame', query, params, dtypes)
+        if key is None:
+            return await self._fetch_frame(query, params, dtypes, stats)
+        return await self._coalesced(key, lambda: self._fetch_frame(query, params, dtypes, stats),
+                                     lambda df: df.copy())
+
+    def is_in_flight(self, query: str, params: Tuple | Dict | List = None, dtypes: Dict[str, str] = None) -> bool:
+        key = self._coalesce_key(None, 'frame', query, params, dtypes)
+        return key is not None and key in self.in_flight
+
+    def _coalesce_key(self, coalesce: bool | None, kind: str, query: str, params: Tuple | Dict | List = None,
+                      dtypes: Dict[str, str] = None) -> Tuple | None:
+        """Identity of a fetch for coalescing, None when the call isn't coalesced."""
+        if not (self.coalesce if coalesce is None else coalesce):
+            return None
+        if isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        elif params is not None:
+            params = tuple(params)
+        key = (kind, query, params, tuple(sorted((dtypes or {}).items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    async def _coalesced(self, key: Tuple, fetch: Callable[[], Awaitable], copy: Callable[[Any], Any]) -> Any:
+        """
+        The first caller of ``key`` runs ``fetch``, callers arriving while it runs await the same result.
+        Every caller gets its own copy, the shared result is only returned as is when nobody joined.
+        Cancelling a caller doesn't cancel the shared fetch.
+        """
+        entry = self.in_flight.get(key)
+        if entry is not None:
+            self.coalesced_hits += 1
+            entry[1] += 1
+            return copy(await asyncio.shield(entry[0]))
+        future = asyncio.ensure_future(fetch())
+        entry = self.in_flight[key] = [future, 0]
+        future.add_done_callback(lambda done: self._forget(key, done))
+        result = await asyncio.shield(future)
+        # _forget ran before this resumes, so no caller can join anymore and the count is final
+        return copy(result) if entry[1] else result
+
+    def _forget(self, key: Tuple, future: asyncio.Future):
+        self.in_flight.pop(key, None)
+        if not future.cancelled():
+            # Marks the exception as retrieved when every caller was cancelled
+            future.exception()
+
+    async def _fetch_frame(self, query: str, params: Tuple | Dict | List, dtypes: Dict[str, str] | None,
+                           stats: FetchStats) -> pd.DataFrame:
+        await self.initialize_pool()
+        start = time.perf_counter()
+        async with self.pool.acquire() as connection:
+            stats.add('pool_acquire', time.perf_counter() - start)
+            async with connection.cursor(aiomysql.Cursor) as cursor:
+                start = time.perf_counter()
+                try:
+                    with stats.stage('sql_execute'):
+                        await self._execute(connection, cursor, query, params)
+                    with stats.stage('row_transfer'):
+                        rows = await cursor.fetchall()
+                    columns = self._column_names(cursor)
+                    check_unique_columns(columns)
+                except Exception as e:
+                    raise QueryExecutionError(message=str(e), query1=query)
+        self._log_query(query, params, time.perf_counter() - start, len(rows))
+        with stats.stage('frame_build'):
+            return frame_from_columns(columns, rows, dtypes)
+
+    def _log_query(self, query: str, params: Tuple | Dict | List, duration: float, rows: int):
+        log = self.slow_query_log
+        if log is None or not log.is_slow(duration):
+            return
+        explain = log.needs_plan(query)
+        entry = log.record(query, params, duration, rows, plan_pending=explain)
+        if explain:
+            # On a connection of its own after the result is returned, the request doesn't wait for it
+            task = asyncio.ensure_future(self._explain(query, params, entry))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+
+    async def _explain(self, query: str, params: Tuple | Dict | List, entry: Dict[str, Any]):
+        try:
+            async with self.pool.acquire() as connection:
+                async with connection.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute('EXPLAIN ' + query, params)
+                    plan = list(await cursor.fetchall())
+        except Exception as e:
+            plan = str(e)
+        self.slow_query_log.add_plan(query, entry, plan)
+
+    @staticmethod
+    def _column_names(cursor) -> List[str]:
+        if cursor.description is None:
+            return []
+        return [column[0] for column in cursor.description]
+
+    async def iter_chunks(self, query: str, params: Tuple | Dict | List = None, chunk_size: int = 10000,
+                          dtypes: Dict[str, str] = None) -> AsyncIterator[pd.DataFrame]:
+        """
+        Stream the result through an unbuffered server-side cursor.
+        Only ``chunk_size`` rows are held in memory at a time.
+        """
+        await self.initialize_pool()
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(aiomysql.SSCursor) as cursor:
                 try:
                     await cursor.execute(query, params)
-                    return await cursor.fetchall()
+                    rows = await cursor.fetchmany(chunk_size)
+                    columns = self._column_names(cursor)
+                    check_unique_columns(columns)
                 except Exception as e:
                     raise QueryExecutionError(message=str(e), query1=query)
+                while rows:
+                    yield frame_from_columns(columns, rows, dtypes)
+                    try:
+                        rows = await cursor.fetchmany(chunk_size)
+                    except Exception as e:
+                        raise QueryExecutionError(message=str(e), query1=query)
 
     async def execute_update(self, query: str, params: Tuple | Dict = None) -> int:
         await self.initialize_pool()
@@ -59,7 +278,28 @@ class DBManager(BaseDBManager):
                 except Exception as e:
                     raise QueryExecutionError(message=str(e), query1=query)
 
+    async def execute_transaction(self, statements: Sequence[Tuple[str, Tuple | Dict | List | None]]) -> List[int]:
+        await self.initialize_pool()
+        counts = []
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await connection.begin()
+                query = None
+                try:
+                    for query, params in statements:
+                        await cursor.execute(query, params)
+                        counts.append(cursor.rowcount)
+                    await connection.commit()
+                except Exception as e:
+                    await connection.rollback()
+                    raise QueryExecutionError(message=str(e), query1=query)
+        return counts
+
     async def close(self):
+        # Pending EXPLAINs need the pool, finish them and the log file before it closes
+        await asyncio.gather(*self.background_tasks)
+        if self.slow_query_log is not None:
+            await self.slow_query_log.flush()
         if self.pool:
             self.pool.close()
             await self.pool.wait_closed()
@@ -77,19 +317,48 @@ class DBManager(BaseDBManager):
         results = await self.fetch_all(query, metric_names)
         return {row['metric_name']: row['sql_value'] for row in results}
 
-    async def get_combined_data(self, query1: SingleQueryBuilder, query2: SingleQueryBuilder, merge_on: Iterable[str]) -> pd.DataFrame:
+    async def get_combined_data(self, query1: SingleQueryBuilder, query2: SingleQueryBuilder, merge_on: Iterable[str],
+                                join_in_sql: bool = False) -> pd.DataFrame:
+        """
+        Fetch both queries concurrently and join them on ``merge_on``, set as the index of both frames.
+        Numeric columns are coerced first, so Decimal results are merged as float64 rather than object.
+        The keys come first in the result.
+        :param join_in_sql: Join the two queries in a single SQL statement instead of in pandas.
+            Their non-key columns must not overlap.
+        """
+        merge_on = list(merge_on)
         if query1 and query2:
-            data1 = await self.fetch_all(query1.get_query(), query1.get_args())
-            data2 = await self.fetch_all(query2.get_query(), query2.get_args())
-            if len(data1) == 0 or len(data2) == 0:
+            if join_in_sql:
+                query, args = self.combined_query(query1, query2, merge_on)
+                return await self.fetch_frame(query, args, {})
+            df1, df2 = await asyncio.gather(
+                self.fetch_frame(query1.get_query(), query1.get_args(), {}),
+                self.fetch_frame(query2.get_query(), query2.get_args(), {})
+            )
+            if df1.empty or df2.empty:
                 return pd.DataFrame()
-            df = pd.merge(pd.DataFrame(data1), pd.DataFrame(data2), on=merge_on)
+            df = df1.set_index(merge_on).join(df2.set_index(merge_on), how='inner', lsuffix='_x', rsuffix='_y')
+            df = df.reset_index()
         elif query1:
-            data1 = await self.fetch_all(query1.get_query(), query1.get_args())
-            df = pd.DataFrame(data1)
+            df = await self.fetch_frame(query1.get_query(), query1.get_args(), {})
         elif query2:
-            data2 = await self.fetch_all(query2.get_query(), query2.get_args())
-            df = pd.DataFrame(data2)
+            df = await self.fetch_frame(query2.get_query(), query2.get_args(), {})
         else:
             raise EmptyQueryError()
         return df
+
+    @staticmethod
+    def combined_query(query1: SingleQueryBuilder, query2: SingleQueryBuilder,
+                       merge_on: List[str]) -> Tuple[str, List]:
+        """
+        Inner join of both queries as derived tables, pushed down to the database.
+        Raises ValueError when their non-key columns overlap, ``SELECT *`` would return duplicate labels.
+        """
+        columns1 = {BaseQueryBuilder._parse_select(select)[1] for select in query1.sql_query.select}
+        columns2 = {BaseQueryBuilder._parse_select(select)[1] for select in query2.sql_query.select}
+        overlap = (columns1 & columns2) - set(merge_on)
+        if overlap:
+            raise ValueError(f'Columns in both queries besides the join keys: {", ".join(sorted(overlap))}')
+        query = (f'SELECT * FROM ({query1.get_query()}) AS q1 '
+                 f'JOIN ({query2.get_query()}) AS q2 USING ({", ".join(merge_on)})')
+        return query, list(query1.get_args()) + list(query2.get_args())
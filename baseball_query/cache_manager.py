@@ -1,33 +1,102 @@
+import asyncio
+import json
+import os
+import sys
 import time
-from typing import List, Dict
-from .abc import BaseDBManager, DBMetric, BaseCache
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple, Callable, Awaitable
+from .abc import BaseDBManager, BaseQueryBuilder, DBMetric, BaseCache, ColumnInfo
+from .admission import AdmissionController, admitted
+
+# Bumped whenever the snapshot layout changes, snapshots of another format are ignored
+SNAPSHOT_FORMAT = 2
+
+
+def estimate_size(data: Any) -> int:
+    """Approximate size in bytes of a DataFrame or of a list of result rows."""
+    if hasattr(data, 'memory_usage'):
+        return int(data.memory_usage(deep=True).sum())
+    size = sys.getsizeof(data)
+    if isinstance(data, (list, tuple)):
+        for row in data:
+            size += sys.getsizeof(row)
+            values = row.values() if isinstance(row, dict) else row
+            size += sum(sys.getsizeof(value) for value in values)
+    return size
 
 
 class ConstantsCache(BaseCache):
     """Simple in-memory cache for database constants and metrics."""
 
-    def __init__(self, db_manager: BaseDBManager, ttl: int = 3600):
+    def __init__(self, db_manager: BaseDBManager, ttl: int = 3600, reference_ttl: int = 86400,
+                 stale_while_revalidate: bool = False, snapshot_path: str | None = None,
+                 admission: AdmissionController | None = None):
+        """
+        :param ttl: Seconds before metric metadata is reloaded.
+        :param reference_ttl: Seconds before rarely changing reference tables are reloaded.
+        :param stale_while_revalidate: Serve expired entries immediately while a background task reloads them.
+        :param snapshot_path: Local JSON file used to persist the metric metadata between processes.
+        :param admission: Controller of the client, every load takes one of its BACKGROUND slots.
+        """
         if not hasattr(self, 'cache'):
             self.db_manager = db_manager
             self.ttl = ttl
+            self.reference_ttl = reference_ttl
+            self.stale_while_revalidate = stale_while_revalidate
+            self.snapshot_path = snapshot_path
+            self.admission = admission
+            self.snapshot_task: asyncio.Future | None = None
             self.cache = {}
+            self.loading: Dict[str, asyncio.Future] = {}
 
-    def get_cache_entry(self, key: str):
+    def get_cache_entry(self, key: str, ttl: int | None = None):
+        if ttl is None:
+            ttl = self.ttl
         cache_entry = self.cache.get(key)
-        if cache_entry and time.time() - cache_entry['timestamp'] < self.ttl:
+        if cache_entry and time.time() - cache_entry['timestamp'] < ttl:
             return cache_entry
         return None
 
-    async def get_metric_from_cache(self, key: str, query, column_name) -> List[str] | None:
-        cache_entry = self.get_cache_entry(key)
+    def refresh(self, key: str | None = None):
+        """Drop one entry, or every entry, so the next lookup reloads it from the database."""
+        if key is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(key, None)
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: int | None = None) -> Any:
+        """
+        Return the cached value for ``key`` or load it with ``loader``.
+        Concurrent misses share a single load (single-flight).
+        """
+        cache_entry = self.get_cache_entry(key, ttl)
         if cache_entry:
             return cache_entry['data']
-        data = await self.db_manager.get_column_values(query, column_name)
-        self.cache[key] = {
-            'data': data,
-            'timestamp': time.time()
-        }
-        return self.cache[key]['data']
+        future = self.loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key, loader))
+            # Retrieve the exception of background refreshes nobody awaits
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self.loading[key] = future
+        stale_entry = self.cache.get(key)
+        if self.stale_while_revalidate and stale_entry:
+            return stale_entry['data']
+        return await asyncio.shield(future)
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            async with admitted(self.admission):
+                data = await loader()
+            self.cache[key] = {
+                'data': data,
+                'timestamp': time.time()
+            }
+            return data
+        finally:
+            self.loading.pop(key, None)
+
+    async def get_metric_from_cache(self, key: str, query, column_name) -> List[str] | None:
+        return await self.get_or_load(key, lambda: self.db_manager.get_column_values(query, column_name))
 
     # Getters for the constants
     async def get_totals_batter(self) -> List[str]:
@@ -47,31 +116,197 @@ class ConstantsCache(BaseCache):
         return await self.get_metric_from_cache('GROUP_METRICS', query, 'metric_name')
 
     async def get_metrics_dict(self) -> Dict[str, DBMetric]:
-        key = 'DB_METRICS'
-        cache_entry = self.get_cache_entry(key)
-        if cache_entry:
-            return cache_entry['data']
+        return await self.get_or_load('DB_METRICS', self._load_metrics_dict)
+
+    async def _load_metrics_dict(self) -> Dict[str, DBMetric]:
         metrics = {}
         data = await self.db_manager.fetch_all('SELECT * FROM metrics')
         for row in data:
             metrics[row['metric_name']] = DBMetric(row)
-        self.cache[key] = {
-            'data': metrics,
-            'timestamp': time.time()
-        }
         return metrics
 
-    async def get_table_columns_dict(self):
-        key = 'TABLE_COLUMNS'
-        cache_entry = self.get_cache_entry(key)
-        if cache_entry:
-            return cache_entry['data']
-        table_columns = {}
-        for table in self.get_tables():
-            values = await self.db_manager.get_column_values(f'DESCRIBE {table}', 'Field')
-            table_columns[table] = values
-        self.cache[key] = {
-            'data': table_columns,
+    async def get_table_columns_dict(self) -> Dict[str, List[str]]:
+        schema = await self.get_table_schema()
+        return schema['columns']
+
+    async def get_column_index(self) -> Dict[str, Tuple[ColumnInfo, ...]]:
+        """Map of column name to the tables that have it, in get_tables() order."""
+        schema = await self.get_table_schema()
+        return schema['index']
+
+    async def get_table_schema(self) -> Dict[str, Any]:
+        return await self.get_or_load('TABLE_SCHEMA', self._load_table_schema)
+
+    async def _load_table_schema(self) -> Dict[str, Any]:
+        rows = await self.db_manager.fetch_table_schema(self.get_tables())
+        return self._index_schema(rows)
+
+    def _index_schema(self, rows: List[Dict]) -> Dict[str, Any]:
+        table_columns = {table: [] for table in self.get_tables()}
+        for row in rows:
+            table_columns.setdefault(row['table_name'], []).append(row['column_name'])
+        types = {(row['table_name'], row['column_name']): row['data_type'] for row in rows}
+        index: Dict[str, Tuple[ColumnInfo, ...]] = {}
+        for table, columns in table_columns.items():
+            for column in columns:
+                index[column] = index.get(column, ()) + (ColumnInfo(table, column, types[(table, column)]),)
+        return {
+            'rows': rows,
+            'columns': table_columns,
+            'index': index
+        }
+
+    async def get_batted_ball_probabilities(self) -> List[Dict]:
+        return await self.get_or_load('BATTED_BALL_PROBABILITIES',
+                                      lambda: self.db_manager.fetch_all('SELECT * FROM batted_ball_probabilities'),
+                                      self.reference_ttl)
+
+    # Snapshot of the metric metadata
+    async def load_snapshot(self) -> bool:
+        """
+        Fill the metric metadata from the snapshot file and validate it in the background.
+        A missing, unreadable or older format snapshot is ignored and rewritten in the background instead.
+        """
+        if self.snapshot_path is None:
+            return False
+        snapshot = self._read_snapshot()
+        if snapshot is None:
+            self._run_in_background(self.save_snapshot())
+            return False
+        now = time.time()
+        self.cache['DB_METRICS'] = {
+            'data': snapshot['metrics'],
+            'timestamp': now
+        }
+        self.cache['TABLE_SCHEMA'] = {
+            'data': snapshot['table_schema'],
+            'timestamp': now
+        }
+        self._run_in_background(self.validate_snapshot(snapshot['version']))
+        return True
+
+    def _read_snapshot(self) -> Dict[str, Any] | None:
+        """The parsed snapshot file, None when it can't be used."""
+        try:
+            with open(self.snapshot_path) as file:
+                snapshot = json.load(file)
+            if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+                return None
+            return {
+                'version': snapshot['version'],
+                'metrics': {row['metric_name']: DBMetric(row) for row in snapshot['metrics']},
+                'table_schema': self._index_schema(snapshot['table_schema'])
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    async def validate_snapshot(self, version: Any) -> bool:
+        """Reload the metadata and rewrite the snapshot if the metrics table changed since it was taken."""
+        if await self._metrics_version() == version:
+            return True
+        self.refresh('DB_METRICS')
+        self.refresh('TABLE_SCHEMA')
+        await self.save_snapshot()
+        return False
+
+    async def save_snapshot(self):
+        if self.snapshot_path is None:
+            return
+        # Probe first so a concurrent change to metrics makes the snapshot look stale, not fresh
+        version = await self._metrics_version()
+        metrics = await self.get_metrics_dict()
+        snapshot = {
+            'format': SNAPSHOT_FORMAT,
+            'version': version,
+            'saved_at': time.time(),
+            'metrics': [metric.to_dict() for metric in metrics.values()],
+            'table_schema': (await self.get_table_schema())['rows']
+        }
+        temp_path = f'{self.snapshot_path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(snapshot, file, default=str)
+        os.replace(temp_path, self.snapshot_path)
+
+    async def _metrics_version(self) -> Any:
+        async with admitted(self.admission):
+            version = await self.db_manager.get_table_checksum('metrics')
+        # Round trip through JSON so it compares equal to the stored version
+        return json.loads(json.dumps(version, default=str))
+
+    def _run_in_background(self, coroutine: Awaitable):
+        self.snapshot_task = asyncio.ensure_future(coroutine)
+        self.snapshot_task.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class ResultCache:
+    """LRU cache of query results with a per-entry TTL and a total memory budget."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: int = 300, store: str = 'processed'):
+        """
+        :param max_bytes: Total estimated size of the cached results before the least recently used are evicted.
+        :param ttl: Seconds an entry stays valid.
+        :param store: 'raw' caches the query result, 'processed' caches the DataFrame after the Processor ran.
+        """
+        if store not in ('raw', 'processed'):
+            raise ValueError(f'Unknown result cache store: {store}')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self.entries: OrderedDict[Tuple, Dict] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query_builder: BaseQueryBuilder, processed: bool = False) -> Tuple:
+        key = (query_builder.get_query(), tuple(query_builder.get_args()))
+        if processed:
+            # python metrics are computed after the query and are not part of the SQL
+            key += (tuple(query_builder.python_metrics),)
+        return key
+
+    def get(self, key: Tuple) -> Any | None:
+        entry = self.entries.get(key)
+        if entry is not None and time.time() - entry['timestamp'] >= self.ttl:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry['data']
+
+    def set(self, key: Tuple, data: Any):
+        size = estimate_size(data)
+        if key in self.entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = {
+            'data': data,
+            'size': size,
             'timestamp': time.time()
         }
-        return table_columns
\ No newline at end of file
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Tuple):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry['size']
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes
+        }
@@ -3,6 +3,12 @@ import pandas as pd
 from typing import *
 from .abc import VectorizedMetric
 
+# dtypes of the all_plays columns read by the metrics below
+PLAYS_COLUMN_DTYPES = {
+    'hit_speeds': 'float64',
+    'launch_angles': 'float64',
+}
+
 
 class PulledFB(VectorizedMetric):
     """Compute pulled fly ball percentage and average exit velocity."""
@@ -13,8 +19,8 @@ class PulledFB(VectorizedMetric):
 
     def calculate(self, temp_df: pd.DataFrame) -> dict:
         # spray_angle = -arctan((hc_x - 130) / (213 - hc_y)) + pi / 2
-        hc_x = temp_df['hit_coordinates'].apply(lambda coord: coord[0])
-        hc_y = temp_df['hit_coordinates'].apply(lambda coord: coord[1])
+        hc_x = temp_df['hc_x']
+        hc_y = temp_df['hc_y']
         home_x, home_y = 130, 213
 
         # Spray angle calculation with home plate adjustment
@@ -39,35 +45,73 @@ class PulledFB(VectorizedMetric):
 class ExpectedWeightedOBA(VectorizedMetric):
     """Estimate expected wOBA based on batted ball probabilities."""
 
+    # Exit velocity and launch angle bin widths of the batted_ball_probabilities table
+    ev_bin_size = 2
+    la_bin_size = 3
+
+    # id of a probabilities list -> (that list, its lookup table and offsets), built once per list
+    _lookup_tables: Dict[int, Tuple[List[Dict], Tuple['np.ndarray', int, int]]] = {}
+
     def __init__(self, probabilities: List[Dict] = None):
         super().__init__(['xwOBA', 'xwOBAcon'],
                          dependencies=('hit_speeds', 'launch_angles'))
         self.requires_row = True
         self.probabilities = probabilities
+        # Weights for single, double, triple and home run
+        self.hit_weights = np.array([0.882, 1.254, 1.59, 2.05])
+        self.lookup_table, self.ev_offset, self.la_offset = self.get_lookup_table(probabilities or [])
+
+    @classmethod
+    def get_lookup_table(cls, probabilities: List[Dict]) -> Tuple['np.ndarray', int, int]:
+        """
+        The lookup table of ``probabilities``, memoized on the list's identity.
+        ConstantsCache hands out the same list until it reloads the table, so it is built once per load.
+        """
+        cached = cls._lookup_tables.get(id(probabilities))
+        if cached is not None and cached[0] is probabilities:
+            return cached[1]
+        table = cls._build_lookup_table(probabilities)
+        if probabilities:
+            if len(cls._lookup_tables) >= 8:
+                cls._lookup_tables.clear()
+            # Keeping the list alive keeps its id from being reused by another one
+            cls._lookup_tables[id(probabilities)] = (probabilities, table)
+        return table
+
+    @classmethod
+    def _build_lookup_table(cls, probabilities: List[Dict]) -> Tuple['np.ndarray', int, int]:
+        """Dense (ev_bin, la_bin, outcome) array of the probabilities and its offsets, missing bins are zero."""
+        outcomes = ('prob_single', 'prob_double', 'prob_triple', 'prob_home_run')
+        # Bins off the grid can never match a binned batted ball
+        rows = [row for row in probabilities
+                if int(row['ev_bin']) % cls.ev_bin_size == 0 and int(row['la_bin']) % cls.la_bin_size == 0]
+        if not rows:
+            return np.zeros((0, 0, len(outcomes))), 0, 0
+        ev_idx = np.array([int(row['ev_bin']) // cls.ev_bin_size for row in rows])
+        la_idx = np.array([int(row['la_bin']) // cls.la_bin_size for row in rows])
+        values = np.array([[float(row[outcome]) for outcome in outcomes] for row in rows])
+        ev_offset, la_offset = ev_idx.min(), la_idx.min()
+        ev_idx -= ev_offset
+        la_idx -= la_offset
+        lookup_table = np.zeros((ev_idx.max() + 1, la_idx.max() + 1, len(outcomes)))
+        # Accumulate so duplicate bins count twice, like the merge they replace
+        np.add.at(lookup_table, (ev_idx, la_idx), values)
+        # Shared by every instance built from the same list
+        lookup_table.flags.writeable = False
+        return lookup_table, ev_offset, la_offset
 
     def calculate(self, temp_df: pd.DataFrame) -> dict:
-        probabilities = pd.DataFrame(self.probabilities)
-        ev_la_pairs = [
-            (int((ev // 2) * 2), int((la // 3) * 3))
-            for ev, la in zip(temp_df['hit_speeds'], temp_df['launch_angles'])
-            if not (np.isnan(ev) or np.isnan(la))
-        ]
-        ev_la_pairs_df = pd.DataFrame(ev_la_pairs, columns=['ev_bin', 'la_bin'])
-        ev_la_pair_counts = ev_la_pairs_df.value_counts().reset_index(name='frequency')
-
-        # Step 2: Merge ev_la_pair_counts with probabilities for matching pairs
-        matched_probs = probabilities.merge(ev_la_pair_counts, on=['ev_bin', 'la_bin'], how='inner')
-
-        # Step 3: Compute adjusted probabilities directly during the merge
-        matched_probs['prob_single'] *= matched_probs['frequency']
-        matched_probs['prob_double'] *= matched_probs['frequency']
-        matched_probs['prob_triple'] *= matched_probs['frequency']
-        matched_probs['prob_home_run'] *= matched_probs['frequency']
-        # Sum probabilities for relevant outcomes
-        prob_single = matched_probs['prob_single'].sum()
-        prob_double = matched_probs['prob_double'].sum()
-        prob_triple = matched_probs['prob_triple'].sum()
-        prob_home_run = matched_probs['prob_home_run'].sum()
+        hit_speeds = temp_df['hit_speeds'].to_numpy(dtype=float)
+        launch_angles = temp_df['launch_angles'].to_numpy(dtype=float)
+        valid = ~(np.isnan(hit_speeds) | np.isnan(launch_angles))
+        ev_idx = np.floor_divide(hit_speeds[valid], self.ev_bin_size).astype(np.int64) - self.ev_offset
+        la_idx = np.floor_divide(launch_angles[valid], self.la_bin_size).astype(np.int64) - self.la_offset
+        n_ev, n_la = self.lookup_table.shape[:2]
+        in_table = (ev_idx >= 0) & (ev_idx < n_ev) & (la_idx >= 0) & (la_idx < n_la)
+
+        # Expected single, double, triple and home run counts over all batted balls
+        prob_hits = self.lookup_table[ev_idx[in_table], la_idx[in_table]].sum(axis=0)
+        weighted_hits = float(prob_hits @ self.hit_weights)
 
         base_on_balls = float(self.original_row['base_on_balls'])
         intentional_walks = float(self.original_row['intentional_walks'])
@@ -75,24 +119,18 @@ class ExpectedWeightedOBA(VectorizedMetric):
         hit_by_pitch = float(self.original_row['hit_by_pitch'])
         at_bats = float(self.original_row['at_bats'])
         sac_flies = float(self.original_row['sac_flies'])
-        batted_ball_events = len(ev_la_pairs)
+        batted_ball_events = int(valid.sum())
 
-        # Weights for xwOBA and xwOBACON
-        w_1b, w_2b, w_3b, w_hr, w_bb, w_hbp = 0.882, 1.254, 1.59, 2.05, 0.689, 0.72
+        # Weights for walks and hit by pitch
+        w_bb, w_hbp = 0.689, 0.72
 
-        xw_oba = (((w_1b * prob_single) +
-                 (w_2b * prob_double) +
-                 (w_3b * prob_triple) +
-                 (w_hr * prob_home_run) +
+        xw_oba = ((weighted_hits +
                  (w_bb * un_intentional_walks) +
                  (w_hbp * hit_by_pitch)) /
                  (at_bats + un_intentional_walks + sac_flies + hit_by_pitch)) if (
                  (at_bats + un_intentional_walks + sac_flies + hit_by_pitch) > 0) else 0
 
-        xw_oba_con = ((w_1b * prob_single) +
-                    (w_2b * prob_double) +
-                    (w_3b * prob_triple) +
-                    (w_hr * prob_home_run)) / batted_ball_events if batted_ball_events > 0 else 0
+        xw_oba_con = weighted_hits / batted_ball_events if batted_ball_events > 0 else 0
 
         return {
                 'xwOBA': xw_oba,
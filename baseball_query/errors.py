@@ -35,3 +35,11 @@ class QueryExecutionError(BaseballStatsError):
 
     def __str__(self):
         return self.message + ' ' + self.query1
+
+
+class MetricDependencyError(BaseballStatsError):
+    """Raised when metric dependencies form a cycle."""
+
+    def __init__(self, message: str = 'Circular metric dependency', metric: str = None):
+        super().__init__(message if metric is None else f'{message}: {metric}')
+        self.metric = metric
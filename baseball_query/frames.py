@@ -0,0 +1,58 @@
+import pandas as pd
+from typing import *
+
+# infer_dtype results for object columns holding only numbers, Decimals and None
+NUMERIC_INFERRED_TYPES = ('decimal', 'floating', 'integer', 'mixed-integer-float')
+
+
+def coerce_dtypes(df: pd.DataFrame, dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    Cast columns to their declared dtype in place.
+    Undeclared object columns that only hold numbers become float64, turning None into NaN.
+    """
+    dtypes = dtypes or {}
+    for column in df.columns:
+        dtype = dtypes.get(column)
+        if dtype is None and df[column].dtype == object:
+            if pd.api.types.infer_dtype(df[column], skipna=True) in NUMERIC_INFERRED_TYPES:
+                dtype = 'float64'
+        if dtype is not None and df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def frame_from_records(rows: List[Dict], dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Build a DataFrame from cursor rows, coercing column types when ``dtypes`` is given."""
+    df = pd.DataFrame(rows)
+    if dtypes is not None:
+        coerce_dtypes(df, dtypes)
+    return df
+
+
+def check_unique_columns(columns: Sequence[str]):
+    """Raise ValueError for duplicate column labels, a DataFrame built from them would silently drop columns."""
+    if len(set(columns)) != len(columns):
+        duplicates = sorted({column for column in columns if columns.count(column) > 1})
+        raise ValueError(f'Duplicate column labels in the result: {", ".join(duplicates)}')
+
+
+def frame_from_columns(columns: List[str], rows: Sequence[Tuple], dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """Build a DataFrame from tuple rows by transposing them into one list per column."""
+    check_unique_columns(columns)
+    if rows:
+        data = dict(zip(columns, map(list, zip(*rows))))
+    else:
+        data = {column: [] for column in columns}
+    df = pd.DataFrame(data, columns=list(data))
+    if dtypes is not None:
+        coerce_dtypes(df, dtypes)
+    return df
+
+
+def add_coordinate_columns(temp_df: pd.DataFrame) -> pd.DataFrame:
+    """Parse ``hit_coordinates`` strings like ``"x:y"`` into float64 ``hc_x`` and ``hc_y`` columns."""
+    # reindex keeps both columns when every coordinate is missing
+    coords = temp_df['hit_coordinates'].astype('string').str.split(':', n=2, expand=True).reindex(columns=[0, 1])
+    temp_df['hc_x'] = pd.to_numeric(coords[0], errors='coerce').astype('float64')
+    temp_df['hc_y'] = pd.to_numeric(coords[1], errors='coerce').astype('float64')
+    return temp_df
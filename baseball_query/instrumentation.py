@@ -0,0 +1,82 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import *
+import pandas as pd
+
+
+class FetchStats:
+    """
+    Per-stage timings, row counts and byte estimates of one fetch_data call.
+    Stages running concurrently (the per-row plays queries) add up, so their total can exceed the wall time.
+    """
+
+    enabled = True
+
+    def __init__(self, builder: str = ''):
+        self.builder = builder
+        self.timings: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.metric_timings: Dict[str, float] = {}
+        self.rows: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.total = 0.0
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def add_metric_timings(self, timings: Dict[str, float]):
+        for name, seconds in timings.items():
+            self.metric_timings[name] = self.metric_timings.get(name, 0.0) + seconds
+
+    def add_frame(self, name: str, df: pd.DataFrame):
+        self.rows[name] = self.rows.get(name, 0) + len(df)
+        self.bytes[name] = self.bytes.get(name, 0) + int(df.memory_usage(index=False).sum())
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'builder': self.builder,
+            'total': self.total,
+            'timings': dict(self.timings),
+            'calls': dict(self.calls),
+            'metric_timings': dict(self.metric_timings),
+            'rows': dict(self.rows),
+            'bytes': dict(self.bytes)
+        }
+
+
+class NullStats:
+    """FetchStats stand-in used while instrumentation is disabled, every call is a no-op."""
+
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name: str):
+        return self._context
+
+    def add(self, name: str, seconds: float):
+        pass
+
+    def add_metric_timings(self, timings: Dict[str, float]):
+        pass
+
+    def add_frame(self, name: str, df: pd.DataFrame):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_STATS = NullStats()
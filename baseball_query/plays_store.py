@@ -0,0 +1,171 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from typing import *
+from .abc import BaseDBManager
+from .admission import AdmissionController, admitted
+from .complex_metrics import PLAYS_COLUMN_DTYPES
+from .frames import add_coordinate_columns
+
+# all_plays columns read by complex_metrics, hit_coordinates is stored parsed as hc_x and hc_y
+PLAYS_STORE_COLUMNS = ('hit_speeds', 'launch_angles', 'trajectories', 'bat_sides', 'hit_coordinates')
+NUMERIC_COLUMNS = ('hit_speeds', 'launch_angles', 'hc_x', 'hc_y')
+CATEGORICAL_COLUMNS = ('trajectories', 'bat_sides')
+MANIFEST = 'manifest.json'
+
+
+def _partition_path(directory: str, season: str, player_type: str) -> str:
+    return os.path.join(directory, f'season={season}', player_type)
+
+
+async def season_version(db_manager: BaseDBManager, season: str) -> Any:
+    """
+    Fingerprint of the season's plays in the database: the row count and the sums of the numeric columns,
+    so inserted, deleted and corrected plays all change it.
+    """
+    sums = ', '.join(f'ROUND(SUM({column}), 3) AS {column}' for column in ('hit_speeds', 'launch_angles'))
+    rows = await db_manager.fetch_all(f'SELECT COUNT(*) AS row_count, {sums} FROM all_plays WHERE season = %s',
+                                      [season])
+    # Round trip through JSON so it compares equal to the version stored in the manifest
+    return json.loads(json.dumps(rows[0] if rows else None, default=str))
+
+
+def write_partition(path: str, plays_df: pd.DataFrame, id_column: str, version: Any = None):
+    """
+    Write the plays of one season and player type as .npy column files sorted by ``id_column``.
+    ``offsets[i]:offsets[i + 1]`` is the row range of ``player_ids[i]``.
+    :param version: season_version when the plays were read, PlaysStore compares it with the database.
+    """
+    os.makedirs(path, exist_ok=True)
+    # Stable, so each player's plays keep the order the database returned them in
+    plays_df = plays_df.sort_values(id_column, kind='stable', ignore_index=True)
+    ids = plays_df[id_column].to_numpy(dtype=np.int64)
+    player_ids, starts = np.unique(ids, return_index=True)
+    offsets = np.append(starts, len(ids)).astype(np.int64)
+    np.save(os.path.join(path, 'player_ids.npy'), player_ids)
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    if 'hit_coordinates' in plays_df.columns:
+        plays_df = add_coordinate_columns(plays_df)
+    categories = {}
+    for column in NUMERIC_COLUMNS:
+        if column in plays_df.columns:
+            np.save(os.path.join(path, f'{column}.npy'), plays_df[column].to_numpy(dtype=np.float64))
+    for column in CATEGORICAL_COLUMNS:
+        if column in plays_df.columns:
+            categorical = pd.Categorical(plays_df[column])
+            categories[column] = [str(category) for category in categorical.categories]
+            np.save(os.path.join(path, f'{column}.npy'), categorical.codes.astype(np.int32))
+    manifest = {'id_column': id_column, 'rows': len(ids), 'players': len(player_ids), 'categories': categories,
+                'version': version}
+    with open(os.path.join(path, MANIFEST), 'w') as file:
+        json.dump(manifest, file)
+
+
+async def export_plays_store(db_manager: BaseDBManager, directory: str, seasons: Iterable[str],
+                             player_types: Sequence[str] = ('batter', 'pitcher'),
+                             admission: AdmissionController = None) -> Dict[Tuple[str, str], int]:
+    """
+    Export the plays columns of every season for PlaysStore, one query per season and player type.
+    Returns the number of plays written per (season, player_type).
+    :param admission: Controller of a client sharing ``db_manager``, each query takes one of its BACKGROUND slots.
+    """
+    counts = {}
+    for season in seasons:
+        # Probed first so plays changing during the export make it look stale, not fresh
+        async with admitted(admission):
+            version = await season_version(db_manager, season)
+        for player_type in player_types:
+            id_column = player_type + '_id'
+            query = f'SELECT {id_column}, {", ".join(PLAYS_STORE_COLUMNS)} FROM all_plays WHERE season = %s'
+            async with admitted(admission):
+                plays_df = await db_manager.fetch_frame(query, [season], PLAYS_COLUMN_DTYPES)
+            plays_df = plays_df[plays_df[id_column].notna()]
+            if plays_df.empty:
+                continue
+            write_partition(_partition_path(directory, str(season), player_type), plays_df, id_column, version)
+            counts[(str(season), player_type)] = len(plays_df)
+    return counts
+
+
+class PlaysPartition:
+    """Memory-mapped plays of one season and player type."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST)) as file:
+            manifest = json.load(file)
+        self.version = manifest.get('version')
+        self.player_ids = np.load(os.path.join(path, 'player_ids.npy'))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.numeric = {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+                        for column in NUMERIC_COLUMNS if os.path.exists(os.path.join(path, f'{column}.npy'))}
+        self.categorical = {column: (np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r'), categories)
+                            for column, categories in manifest['categories'].items()}
+
+    def get(self, player_id: int) -> pd.DataFrame:
+        """The player's plays, an empty frame for a player without plays. Numeric columns are views of the map."""
+        i = np.searchsorted(self.player_ids, player_id)
+        if i < len(self.player_ids) and self.player_ids[i] == player_id:
+            start, end = self.offsets[i], self.offsets[i + 1]
+        else:
+            start = end = 0
+        data = {column: values[start:end] for column, values in self.numeric.items()}
+        for column, (codes, categories) in self.categorical.items():
+            data[column] = pd.Categorical.from_codes(codes[start:end], categories=categories)
+        return pd.DataFrame(data, copy=False)
+
+
+class PlaysStore:
+    """Per-season plays written by export_plays_store, sliced by player id without touching the database."""
+
+    def __init__(self, directory: str, ttl: int = 3600):
+        """
+        :param ttl: Seconds before a season's version is compared with the database again.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.partitions: Dict[Tuple[str, str], PlaysPartition | None] = {}
+        # (season, player_type) -> (time of the check, whether the partition matched the database)
+        self.checks: Dict[Tuple[str, str], Tuple[float, bool]] = {}
+
+    def partition(self, season: str, player_type: str) -> PlaysPartition | None:
+        key = (str(season), player_type)
+        if key not in self.partitions:
+            path = _partition_path(self.directory, *key)
+            self.partitions[key] = PlaysPartition(path) if os.path.exists(os.path.join(path, MANIFEST)) else None
+        return self.partitions[key]
+
+    def covers(self, season: str, player_type: str, columns: Iterable[str]) -> bool:
+        """Whether the store holds that season with every one of ``columns``."""
+        partition = self.partition(season, player_type)
+        if partition is None:
+            return False
+        stored = set(partition.numeric) | set(partition.categorical)
+        if 'hc_x' in stored:
+            stored.add('hit_coordinates')
+        return set(columns) <= stored
+
+    async def is_current(self, db_manager: BaseDBManager, season: str, player_type: str,
+                         admission: AdmissionController = None) -> bool:
+        """
+        Whether the partition was exported from the plays the database holds now. A stale partition is dropped,
+        so a new export into the directory is picked up by the next check.
+        """
+        key = (str(season), player_type)
+        check = self.checks.get(key)
+        if check is not None and time.time() - check[0] < self.ttl:
+            return check[1]
+        partition = self.partition(*key)
+        if partition is None:
+            return False
+        async with admitted(admission):
+            version = await season_version(db_manager, key[0])
+        current = partition.version is not None and partition.version == version
+        if not current:
+            self.partitions.pop(key, None)
+        self.checks[key] = (time.time(), current)
+        return current
+
+    def get(self, season: str, player_type: str, player_id: int) -> pd.DataFrame:
+        return self.partition(season, player_type).get(player_id)
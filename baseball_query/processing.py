@@ -1,11 +1,19 @@
 from typing import *
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
-import numpy as np
 import math
+import time
 import asyncio
+import threading
+from collections import OrderedDict
 from .queries import BaseQueryBuilder, PlaysBuilder
-from .complex_metrics import COMPLEX_METRICS_DICT, ExpectedWeightedOBA
-from .abc import BaseQueryFactory, BaseDBManager
+from .complex_metrics import COMPLEX_METRICS_DICT, ExpectedWeightedOBA, PLAYS_COLUMN_DTYPES
+from .abc import BaseQueryFactory, BaseDBManager, VectorizedMetric
+from .frames import add_coordinate_columns
+from .plays_store import PlaysStore
+from .instrumentation import FetchStats, NULL_STATS
+from .query_log import source
+from .admission import BACKGROUND, run_admitted
 
 batter_default_metrics = ('name', 'league', 'pitches', 'bip', 'percentile_90','launch_angles', 'avg_ev', 'max_ev',
                           'avg_hit_angle', 'barrel_per_bbe', 'contact_percent')
@@ -14,28 +22,174 @@ pitcher_default_metrics = ('name', 'league', 'count', 'batters_faced', 'pitches_
                            'k_min_bb')
 
 
-def add_coordinates(coord_str: str) -> Tuple[float, float]:
-    coords = coord_str.split(':')
-    x, y = coords[0], coords[1]
-    return float(x), float(y)
+def calculate_metrics(metric_instances: List[VectorizedMetric], row: pd.Series, temp_df: pd.DataFrame,
+                      timings: Optional[Dict[str, float]] = None) -> Dict:
+    """:param timings: When given, the seconds spent in each metric are added to it by class name."""
+    results = {}
+    for metric in metric_instances:
+        if metric.requires_row:
+            metric.add_row(row)
+        if timings is None:
+            results.update(metric.calculate(temp_df))
+            continue
+        start = time.perf_counter()
+        results.update(metric.calculate(temp_df))
+        name = type(metric).__name__
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+    return results
+
+
+# Metric instances of an executor worker, thread-local so thread workers don't share add_row state
+_worker_state = threading.local()
+
+
+def _init_worker_metrics(metric_specs: List[Tuple[Type[VectorizedMetric], Tuple]]):
+    _worker_state.metric_instances = [metric_class(*args) for metric_class, args in metric_specs]
+
+
+def _calculate_in_worker(row: pd.Series, temp_df: pd.DataFrame, timed: bool = False) -> Tuple[Dict, Dict | None]:
+    timings = {} if timed else None
+    return calculate_metrics(_worker_state.metric_instances, row, temp_df, timings), timings
+
+
+def create_metric_executor(kind: str, metric_specs: List[Tuple[Type[VectorizedMetric], Tuple]],
+                           max_workers: int | None = None) -> Executor:
+    """Worker pool whose workers build their metric instances once, in the initializer."""
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers, initializer=_init_worker_metrics, initargs=(metric_specs,))
+    elif kind == 'thread':
+        return ThreadPoolExecutor(max_workers, initializer=_init_worker_metrics, initargs=(metric_specs,))
+    raise ValueError(f'Unknown executor: {kind}')
+
+
+class MetricExecutors:
+    """
+    Long-lived worker pools of a client, one per set of metric classes, reused across fetch_data calls.
+    A pool is replaced when the constructor arguments of its metrics change, e.g. reloaded probabilities.
+    """
+
+    def __init__(self, kind: str, max_workers: int | None = None, max_pools: int = 4):
+        """
+        :param kind: 'process' or 'thread'.
+        :param max_workers: Workers per pool, defaults to the executor's own default.
+        :param max_pools: Pools kept at once, the least recently used one is shut down first.
+        """
+        if kind not in ('process', 'thread'):
+            raise ValueError(f'Unknown executor: {kind}')
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pools = max_pools
+        # metric classes -> (constructor arguments by class, pool), least recently used first
+        self.pools: OrderedDict[FrozenSet[type], Tuple[Dict[type, Tuple], Executor]] = OrderedDict()
+        self.users: Dict[Executor, int] = {}
+        # Replaced pools still used by a Processor, shut down when it releases them
+        self.retired: Set[Executor] = set()
+
+    def acquire(self, metric_specs: List[Tuple[Type[VectorizedMetric], Tuple]]) -> Executor:
+        key = frozenset(metric_class for metric_class, _ in metric_specs)
+        args = dict(metric_specs)
+        entry = self.pools.get(key)
+        if entry is not None and not self._same_args(entry[0], args):
+            self._retire(key)
+            entry = None
+        if entry is None:
+            if len(self.pools) >= self.max_pools:
+                self._retire(next(iter(self.pools)))
+            entry = self.pools[key] = (args, create_metric_executor(self.kind, metric_specs, self.max_workers))
+        self.pools.move_to_end(key)
+        executor = entry[1]
+        self.users[executor] = self.users.get(executor, 0) + 1
+        return executor
+
+    def release(self, executor: Executor):
+        self.users[executor] -= 1
+        if self.users[executor] == 0:
+            del self.users[executor]
+            if executor in self.retired:
+                self.retired.discard(executor)
+                executor.shutdown(wait=False)
+
+    @staticmethod
+    def _same_args(old: Dict[type, Tuple], new: Dict[type, Tuple]) -> bool:
+        # Identity, the arguments come from ConstantsCache and are only replaced when reloaded
+        return all(len(old[metric_class]) == len(args) and all(a is b for a, b in zip(old[metric_class], args))
+                   for metric_class, args in new.items())
+
+    def _retire(self, key: FrozenSet[type]):
+        _, executor = self.pools.pop(key)
+        if executor in self.users:
+            self.retired.add(executor)
+        else:
+            executor.shutdown(wait=False)
+
+    def shutdown(self):
+        for executor in [executor for _, executor in self.pools.values()] + list(self.retired):
+            executor.shutdown(wait=False)
+        self.pools.clear()
+        self.retired.clear()
+        self.users.clear()
 
 
 class Processor:
     """Handle post-query metric calculations for each result row."""
 
-    def __init__(self, query_builder: BaseQueryBuilder, query_factory: BaseQueryFactory, max_concurrent: int = 10):
+    def __init__(self, query_builder: BaseQueryBuilder, query_factory: BaseQueryFactory, max_concurrent: int = 10,
+                 batched: bool = False, executor: str | None = None, max_workers: int | None = None,
+                 stats: FetchStats = NULL_STATS, plays_store: PlaysStore | None = None,
+                 executors: MetricExecutors | None = None):
+        """
+        :param batched: Fetch the plays for all rows with a single query.
+        :param executor: 'process' or 'thread' to calculate the metrics in a worker pool instead of on the event loop.
+        :param max_workers: Size of that worker pool, defaults to the executor's own default.
+        :param stats: Receives the plays query and metric timings.
+        :param plays_store: Read the plays from this store instead of the database when the query groups by
+            player_id and filters on the season only.
+        :param executors: Long-lived pools to calculate the metrics in, a pool is started and shut down
+            for this Processor when ``executor`` is set without them.
+        """
+        if executor not in (None, 'process', 'thread'):
+            raise ValueError(f'Unknown executor: {executor}')
         self.query_builder = query_builder
         self.query_factory = query_factory
         self.db_manager: BaseDBManager = query_factory.db_manager
         self.max_concurrent = max_concurrent
+        self.batched = batched
+        self.executor = executor
+        self.max_workers = max_workers
+        self.stats = stats
+        self.plays_store = plays_store
+        self.executors = executors
+        self.store_season: str | None = None
+        self.pool_executor: Executor | None = None
+        self.metric_specs: List[Tuple[Type[VectorizedMetric], Tuple]] | None = None
         self.metric_instances = []
         self.semaphore = asyncio.Semaphore(self.max_concurrent)
 
-    async def _build_temp_df(self, row) -> pd.DataFrame:
+    def _plays_column(self, builder: PlaysBuilder, group_column: str) -> str:
+        if group_column == 'player_id':
+            return builder.player_type + '_id'
+        elif group_column == 'team_name':
+            return builder.team_column
+        elif group_column == 'name':
+            return builder.name_column
+        return group_column
+
+    async def _create_plays_builder(self) -> PlaysBuilder:
         python_metrics = self.query_builder.python_metrics
         builder: PlaysBuilder = await self.query_factory.create_query(metrics=python_metrics,
                                                                       player_type=self.query_builder.player_type,
                                                                       builder_cls=PlaysBuilder)
+        return builder
+
+    def _add_parent_filters(self, builder: PlaysBuilder):
+        for where, arg in zip(self.query_builder.get_where_clauses(), self.query_builder.get_args()):
+            if 'name ' in where:
+                continue
+            builder.add_raw_where(where)
+            builder.args.append(arg)
+
+    async def _build_temp_df(self, row) -> pd.DataFrame:
+        builder = await self._create_plays_builder()
         for group_column in self.query_builder.get_group_columns():
             value = row[group_column]
             if group_column == 'player_id':
@@ -46,37 +200,85 @@ class Processor:
                 builder.add_name(value)
             else:
                 builder.add_dynamic_where(group_column, value)
-        for where, arg in zip(self.query_builder.get_where_clauses(), self.query_builder.get_args()):
-            if 'name ' in where:
-                continue
-            builder.add_raw_where(where)
-            builder.args.append(arg)
-        data = await self.db_manager.fetch_all(builder.get_query(), builder.get_args())
-        if not data:
-            return pd.DataFrame()
-        return pd.DataFrame(data)
+        self._add_parent_filters(builder)
+        return await self._fetch_plays(builder)
+
+    async def _fetch_plays(self, builder: PlaysBuilder) -> pd.DataFrame:
+        query, args = builder.get_query(), builder.get_args()
+        with self.stats.stage('plays_queries'), source(type(builder).__name__):
+            plays_df = await run_admitted(
+                self.query_factory.admission, BACKGROUND,
+                lambda: self.db_manager.fetch_frame(query, args, PLAYS_COLUMN_DTYPES, stats=self.stats),
+                lambda: self.db_manager.is_in_flight(query, args, PLAYS_COLUMN_DTYPES))
+        self.stats.add_frame('plays', plays_df)
+        return plays_df
+
+    def _plays_store_season(self) -> str | None:
+        """Season to slice the plays of each row from the plays store, None when they come from the database."""
+        if self.plays_store is None:
+            return None
+        group_columns = set(self.query_builder.get_group_columns())
+        # A name group doesn't split a player's plays any further
+        if 'player_id' not in group_columns or not group_columns <= {'player_id', 'name'}:
+            return None
+        filters = [(where, arg) for where, arg in zip(self.query_builder.get_where_clauses(),
+                                                      self.query_builder.get_args()) if 'name ' not in where]
+        if len(filters) != 1 or filters[0][0] != 'season = %s':
+            return None
+        season = str(filters[0][1])
+        columns = {column for metric in self.metric_instances for column in metric.dependencies}
+        if not self.plays_store.covers(season, self.query_builder.player_type, columns):
+            return None
+        return season
+
+    async def _build_batch_builder(self, df: pd.DataFrame) -> PlaysBuilder:
+        """Create one plays query covering every group key present in ``df``."""
+        builder = await self._create_plays_builder()
+        for group_column in self.query_builder.get_group_columns():
+            column = self._plays_column(builder, group_column)
+            values = list(dict.fromkeys(df[group_column]))
+            builder.sql_query.add_select(column)
+            builder.add_raw_where(f'{column} IN ({", ".join(["%s"] * len(values))})', values)
+        self._add_parent_filters(builder)
+        return builder
+
+    @staticmethod
+    def _prepare_temp_df(temp_df: pd.DataFrame) -> pd.DataFrame:
+        if 'hit_coordinates' in temp_df.columns:
+            temp_df = add_coordinate_columns(temp_df)
+        return temp_df
+
+    async def _calculate_metrics(self, row: pd.Series, temp_df: pd.DataFrame) -> Dict:
+        timings = {} if self.stats.enabled else None
+        if self.pool_executor is None:
+            results = calculate_metrics(self.metric_instances, row, temp_df, timings)
+        else:
+            loop = asyncio.get_running_loop()
+            results, timings = await loop.run_in_executor(self.pool_executor, _calculate_in_worker, row, temp_df,
+                                                          self.stats.enabled)
+        if timings:
+            self.stats.add_metric_timings(timings)
+        return results
+
+    def _create_executor(self, metric_specs: List[Tuple[Type[VectorizedMetric], Tuple]]) -> Executor | None:
+        if self.executor is None:
+            return None
+        return create_metric_executor(self.executor, metric_specs, self.max_workers)
 
     async def process_row(self, index, row: pd.Series):
         async with self.semaphore:
-            temp_df = await self._build_temp_df(row)
+            if self.store_season is not None:
+                with self.stats.stage('plays_store'):
+                    temp_df = self.plays_store.get(self.store_season, self.query_builder.player_type,
+                                                   row['player_id'])
+            else:
+                temp_df = await self._build_temp_df(row)
             if temp_df.empty:
                 return index, {col: None for col in self.query_builder.python_metrics}
-
-            temp_df = temp_df.map(lambda x: np.nan if x is None else x)
-            if 'hit_coordinates' in temp_df.columns:
-                temp_df['hit_coordinates'] = temp_df['hit_coordinates'].map(
-                    lambda x: (np.nan, np.nan) if pd.isna(x) else add_coordinates(x)
-                )
+            with self.stats.stage('plays_prepare'):
+                temp_df = self._prepare_temp_df(temp_df)
             # Process vectorized metrics
-            results = {}
-            for metric in self.metric_instances:
-                if metric.requires_row:
-                    metric.add_row(row)
-                try:
-                    results.update(metric.calculate(temp_df))
-                except Exception:
-                    raise
-            return index, results
+            return index, await self._calculate_metrics(row, temp_df)
 
     async def apply_per_row(self, df: pd.DataFrame) -> pd.DataFrame:
 
@@ -89,16 +291,66 @@ class Processor:
         # Merge results back into the original DataFrame
         return df.join(results_df)
 
+    async def apply_batched(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Same output as ``apply_per_row`` but with a single plays query for all rows.
+        The plays are filtered by the union of the group keys and split with one groupby.
+        """
+        group_columns = self.query_builder.get_group_columns()
+        if df.empty or not group_columns or not all(df[c].all() for c in group_columns):
+            # Falsy keys turn into GROUP BY clauses in the per-row builder, keep those semantics
+            return await self.apply_per_row(df)
+        builder = await self._build_batch_builder(df)
+        plays_df = await self._fetch_plays(builder)
+        groups = {}
+        if not plays_df.empty:
+            with self.stats.stage('plays_prepare'):
+                plays_df = self._prepare_temp_df(plays_df)
+                key_columns = [self._plays_column(builder, c) for c in group_columns]
+                for key, group in plays_df.groupby(key_columns, sort=False):
+                    groups[key] = group
+
+        async def calculate_group(index, row: pd.Series):
+            temp_df = groups.get(tuple(row[c] for c in group_columns))
+            if temp_df is None:
+                return index, {col: None for col in self.query_builder.python_metrics}
+            return index, await self._calculate_metrics(row, temp_df)
+
+        results_list = await asyncio.gather(*[calculate_group(index, row) for index, row in df.iterrows()])
+        results_df = pd.DataFrame([result[1] for result in results_list], index=[result[0] for result in results_list])
+        return df.join(results_df)
+
     async def create_and_calculate_metrics(self, df: pd.DataFrame) -> pd.DataFrame:
         python_metrics = self.query_builder.python_metrics
         if not python_metrics:
             final_df = df
         else:
-            metric_classes = [COMPLEX_METRICS_DICT[m] for m in python_metrics if m in COMPLEX_METRICS_DICT.keys()]
-            metric_classes = list(set(metric_classes))
-            metric_instances = await self.async_initialize_metric_classes(metric_classes)
-            self.metric_instances = metric_instances
-            final_df = await self.apply_per_row(df)
+            if self.metric_specs is None:
+                # Once per Processor, a stream reuses it for all of its chunks
+                metric_classes = [COMPLEX_METRICS_DICT[m] for m in python_metrics if m in COMPLEX_METRICS_DICT.keys()]
+                metric_classes = list(set(metric_classes))
+                self.metric_specs = await self.async_metric_specs(metric_classes)
+                self.metric_instances = [metric_class(*args) for metric_class, args in self.metric_specs]
+                self.store_season = self._plays_store_season()
+                if self.store_season is not None and not await self.plays_store.is_current(
+                        self.db_manager, self.store_season, self.query_builder.player_type,
+                        self.query_factory.admission):
+                    self.store_season = None
+            if self.executors is not None:
+                self.pool_executor = self.executors.acquire(self.metric_specs)
+            else:
+                self.pool_executor = self._create_executor(self.metric_specs)
+            try:
+                if self.batched and self.store_season is None:
+                    final_df = await self.apply_batched(df)
+                else:
+                    final_df = await self.apply_per_row(df)
+            finally:
+                if self.executors is not None:
+                    self.executors.release(self.pool_executor)
+                elif self.pool_executor is not None:
+                    self.pool_executor.shutdown(wait=False)
+                self.pool_executor = None
         final_df = final_df[self.query_builder.get_metric_names() + python_metrics]
         return final_df
 
@@ -111,15 +363,20 @@ class Processor:
     async def calculate_pitcher_rows(self, df: pd.DataFrame) -> pd.DataFrame:
         return await self.create_and_calculate_metrics(df)
 
-    async def async_initialize_metric_classes(self, metric_classes):
-        metric_instances = []
+    async def async_metric_specs(self, metric_classes) -> List[Tuple[Type[VectorizedMetric], Tuple]]:
+        """Constructor arguments of each metric class, picklable so process workers can build them."""
+        metric_specs = []
         for metric_class in metric_classes:
             if metric_class == ExpectedWeightedOBA:
-                batted_ball_probs = await self.db_manager.fetch_all('SELECT * FROM batted_ball_probabilities')
-                metric_instances.append(metric_class(batted_ball_probs))
+                batted_ball_probs = await self.query_factory.cache.get_batted_ball_probabilities()
+                metric_specs.append((metric_class, (batted_ball_probs,)))
             else:
-                metric_instances.append(metric_class())
-        return metric_instances
+                metric_specs.append((metric_class, ()))
+        return metric_specs
+
+    async def async_initialize_metric_classes(self, metric_classes):
+        metric_specs = await self.async_metric_specs(metric_classes)
+        return [metric_class(*args) for metric_class, args in metric_specs]
 
 def calc_release_pos(data) -> tuple[float, float]:
     # going to need to make this work with null values
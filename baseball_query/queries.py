@@ -1,3 +1,4 @@
+import copy
 from typing import List, Tuple, Self, Dict
 from .errors import EmptyQueryError
 from .sql_query import SQLQuery
@@ -111,6 +112,16 @@ class SingleQueryBuilder(BaseQueryBuilder):
     def get_where_clauses(self) -> List[str]:
         return self.sql_query.where
 
+    def copy(self) -> Self:
+        new_builder = copy.copy(self)
+        new_builder.sql_query = self.sql_query.copy()
+        new_builder.args = self.args[:]
+        new_builder.metric_names = self.metric_names[:]
+        new_builder.group_columns = self.group_columns[:]
+        new_builder.order_columns = self.order_columns[:]
+        new_builder.python_metrics = self.python_metrics[:]
+        return new_builder
+
     def add_select(self, metric: DBMetric) -> Self:
         if metric.is_python:
             self.python_metrics.append(metric.metric_name)
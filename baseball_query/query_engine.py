@@ -1,27 +1,67 @@
-from typing import List, Dict, Type, Optional, overload
+import asyncio
+from typing import Any, Callable, List, Dict, Tuple, Type, Optional, AsyncIterator, Sequence, overload
 import pandas as pd
 from .async_db import DBManager
-from .cache_manager import ConstantsCache
+from .cache_manager import ConstantsCache, ResultCache
 from .queries import PlaysBuilder, TotalsBuilder
-from .abc import BaseQueryFactory, BuilderT
-from .processing import Processor
+from .abc import BaseQueryFactory, BaseQueryBuilder, BaseDBManager, BuilderT, DBMetric
+from .errors import MetricDependencyError
+from .instrumentation import FetchStats, NULL_STATS
+from .query_log import SlowQueryLog, source
+from .admission import AdmissionController, INTERACTIVE, run_admitted
+from .processing import Processor, MetricExecutors
+from .plays_store import PlaysStore
+from .rollups import RollupManager
 
 
 class BaseballQueryClient(BaseQueryFactory):
     """Asynchronous client for constructing and running baseball queries."""
 
-    def __init__(self, db_config: Dict = None, pool_size: int = 10):
+    def __init__(self, db_config: Dict = None, pool_size: int = 10, result_cache: ResultCache = None,
+                 snapshot_path: str = None, executor: str = None, on_fetch: Callable[[FetchStats], Any] = None,
+                 slow_query_log: SlowQueryLog = None, db_manager: BaseDBManager = None,
+                 plays_store: PlaysStore = None, rollups: bool = False):
         """
         Initialize the async BaseballStats.
         :param db_config: Database configuration dictionary.
         :param pool_size: Connection pool size for async operation.
+        :param result_cache: Optional cache of fetch_data results, disabled by default.
+        :param snapshot_path: Optional file persisting the metric metadata for fast cold starts.
+        :param executor: 'process' or 'thread' to calculate python metrics off the event loop.
+        :param on_fetch: Called with the FetchStats of every fetch_data call, timing is disabled without it.
+        :param slow_query_log: Passed on to the DBManager to record slow queries.
+        :param db_manager: Backend to run the queries on instead of a MySQL DBManager built from ``db_config``,
+            e.g. a SQLiteDBManager over a local snapshot.
+        :param plays_store: Per-season plays written by export_plays_store, used instead of per-row plays
+            queries for season queries grouped by player_id.
+        :param rollups: Answer eligible date-range totals queries from the daily rollup tables,
+            see RollupManager.refresh for building them.
         """
-        self.db_manager = DBManager(db_config, pool_size)
-        self.cache = ConstantsCache(self.db_manager)
+        self.executor = executor
+        # Worker pools outlive the fetch_data calls so workers build their metric instances once
+        self.metric_executors = MetricExecutors(executor) if executor is not None else None
+        self.plays_store = plays_store
+        self.on_fetch = on_fetch
+        if db_manager is None:
+            db_manager = DBManager(db_config, pool_size, slow_query_log=slow_query_log)
+        self.db_manager = db_manager
+        # Shared by all fetch_data calls and their Processors, totals queries get the higher priority lane.
+        # Sized by the backend's own connection limit, pool_size only applies to a DBManager built here.
+        limit = getattr(db_manager, 'pool_size', None) or getattr(db_manager, 'max_workers', None) or pool_size
+        self.admission = AdmissionController(limit)
+        self.cache = ConstantsCache(self.db_manager, snapshot_path=snapshot_path, admission=self.admission)
+        self.rollups = RollupManager(self.db_manager, self.cache, admission=self.admission) if rollups else None
+        self.result_cache = result_cache
+        self.query_plans: Dict[Tuple, BaseQueryBuilder] = {}
+        self.max_query_plans = 1024
+        self._plans_metrics_dict = None
         self._initialized = False
 
     async def initialize(self):
         await self.db_manager.initialize_pool()
+        await self.cache.load_snapshot()
+        if self.rollups is not None:
+            await self.rollups.load_coverage()
         self._initialized = True
 
     async def close(self):
@@ -29,6 +69,8 @@ class BaseballQueryClient(BaseQueryFactory):
         Clean up resources (e.g., close async pools).
         """
         await self.db_manager.close()
+        if self.metric_executors is not None:
+            self.metric_executors.shutdown()
 
     @overload
     async def create_query(self, metrics: List[str], player_type: str, builder_cls: None = None) -> TotalsBuilder:
@@ -52,30 +94,200 @@ class BaseballQueryClient(BaseQueryFactory):
         if builder_cls is None:
             builder_cls = TotalsBuilder
         metrics_dict = await self.cache.get_metrics_dict()
-        builder = builder_cls(player_type)
-
-        def add_metric(metric):
-            if metric := metrics_dict.get(metric):
-                if metric.dependencies:
-                    for dependency in metric.dependencies:
-                        add_metric(dependency)
-                if metric.metric_name == 'name':
-                    if isinstance(builder, PlaysBuilder):
-                        metrics.append('batter_name' if player_type == 'batter' else 'pitcher_name')
+        if metrics_dict is not self._plans_metrics_dict:
+            # The metrics were reloaded, every plan may be outdated
+            self.query_plans.clear()
+            self._plans_metrics_dict = metrics_dict
+        key = (builder_cls, player_type, tuple(metrics))
+        plan = self.query_plans.get(key)
+        if plan is None:
+            plan = builder_cls(player_type)
+            for metric in self.resolve_metrics(metrics, metrics_dict, plan):
                 if metric.is_grouping:
-                    builder.group_by(metric.metric_name)
-                builder.add_select(metric)
+                    plan.group_by(metric.metric_name)
+                plan.add_select(metric)
+            if len(self.query_plans) >= self.max_query_plans:
+                self.query_plans.pop(next(iter(self.query_plans)))
+            self.query_plans[key] = plan
+        return plan.copy()
+
+    @staticmethod
+    def resolve_metrics(metrics: List[str], metrics_dict: Dict[str, DBMetric],
+                        builder: BaseQueryBuilder) -> List[DBMetric]:
+        """Deduplicated metrics in dependency order, dependencies first."""
+        resolved: Dict[str, DBMetric] = {}
+        visiting = set()
+        extra_metrics = []
+
+        def visit(metric_name):
+            metric = metrics_dict.get(metric_name)
+            if metric is None or metric_name in resolved:
+                return
+            if metric_name in visiting:
+                raise MetricDependencyError(metric=metric_name)
+            visiting.add(metric_name)
+            for dependency in metric.dependencies:
+                visit(dependency)
+            visiting.discard(metric_name)
+            if metric_name == 'name' and isinstance(builder, PlaysBuilder):
+                extra_metrics.append('batter_name' if builder.player_type == 'batter' else 'pitcher_name')
+            resolved[metric_name] = metric
 
         for user_metric in metrics:
-            add_metric(user_metric)
-        return builder
+            visit(user_metric)
+        for extra_metric in extra_metrics:
+            visit(extra_metric)
+        return list(resolved.values())
+
+    async def fetch_data(self, query_builder: BuilderT, skip_processor = False, batched: bool = False) -> pd.DataFrame:
+        """
+        Run the builder's query and post-process the result.
+        :param skip_processor: Return the raw query result without python metrics.
+        :param batched: Fetch the plays for every result row with a single query instead of one per row.
+        """
+        stats = NULL_STATS if self.on_fetch is None else FetchStats(type(query_builder).__name__)
+        try:
+            return await self._fetch_data(query_builder, skip_processor, batched, stats)
+        finally:
+            if stats.enabled:
+                stats.finish()
+                self.on_fetch(stats)
+
+    async def fetch_many(self, query_builders: Sequence[BuilderT], skip_processor: bool = False,
+                         batched: bool = False) -> List[pd.DataFrame]:
+        """
+        fetch_data for many builders concurrently, the DataFrames come back in input order.
+        Builders with the same query, arguments and python metrics are fetched and processed once,
+        each of them still gets its own DataFrame.
+        """
+        keys = [ResultCache.make_key(builder, processed=not skip_processor) for builder in query_builders]
+        tasks: Dict[Tuple, asyncio.Task] = {}
+        for key, builder in zip(keys, query_builders):
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(self.fetch_data(builder, skip_processor, batched))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        results = []
+        seen = set()
+        for key in keys:
+            df = tasks[key].result()
+            results.append(df.copy() if key in seen else df)
+            seen.add(key)
+        return results
+
+    async def _fetch_data(self, query_builder: BuilderT, skip_processor: bool, batched: bool,
+                          stats: FetchStats) -> pd.DataFrame:
+        cache_key = None
+        if self.result_cache is not None and self.result_cache.store == 'processed':
+            with stats.stage('result_cache'):
+                cache_key = self.result_cache.make_key(query_builder, processed=not skip_processor)
+                cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached.copy()
+        df = await self._fetch_frame(query_builder, stats)
+        if not skip_processor:
+            df = await self._process(query_builder, df, batched, stats)
+        if cache_key is not None:
+            self.result_cache.set(cache_key, df.copy())
+        return df
+
+    async def _fetch_frame(self, query_builder: BuilderT, stats: FetchStats = NULL_STATS) -> pd.DataFrame:
+        if self.result_cache is None or self.result_cache.store != 'raw':
+            return await self._fetch_query(query_builder, stats)
+        with stats.stage('result_cache'):
+            cache_key = self.result_cache.make_key(query_builder)
+            cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return cached.copy()
+        df = await self._fetch_query(query_builder, stats)
+        self.result_cache.set(cache_key, df.copy())
+        return df
 
-    async def fetch_data(self, query_builder: BuilderT, skip_processor = False) -> pd.DataFrame:
-        data = await self.db_manager.fetch_all(query_builder.get_query(), query_builder.get_args())
-        df = pd.DataFrame(data)
+    async def _fetch_query(self, query_builder: BuilderT, stats: FetchStats) -> pd.DataFrame:
+        if self.rollups is not None:
+            query_builder = await self.rollups.rewrite(query_builder)
+        query, args = query_builder.get_query(), query_builder.get_args()
+        with source(type(query_builder).__name__):
+            df = await run_admitted(self.admission, INTERACTIVE,
+                                    lambda: self.db_manager.fetch_frame(query, args, stats=stats),
+                                    lambda: self.db_manager.is_in_flight(query, args))
+        stats.add_frame('query', df)
+        return df
+
+    async def stream_data(self, query_builder: BuilderT, chunk_size: int = 10000,
+                          skip_processor: bool = False) -> AsyncIterator[pd.DataFrame]:
+        """
+        Like fetch_data, but yields the result in chunks of at most ``chunk_size`` rows.
+        Memory stays bounded by the chunk size regardless of the result size.
+        Raw chunks are read from one unbuffered cursor. Processed chunks are each fetched by a short keyset
+        query on the group columns and come in that order, so no connection stays open while a chunk's plays
+        queries run.
+        """
         if skip_processor:
-            return df
-        p = Processor(query_builder, self)
+            # The stream keeps its connection until it is exhausted or closed, and its slot with it
+            async with self.admission.slot(INTERACTIVE):
+                async for df in self.db_manager.iter_chunks(query_builder.get_query(), query_builder.get_args(),
+                                                            chunk_size):
+                    yield df
+            return
+        # One Processor, so the metric instances are built once for the whole stream
+        processor = self._create_processor(query_builder)
+        async for df in self._iter_pages(query_builder, chunk_size):
+            yield await self._process(query_builder, df, processor=processor)
+
+    async def _iter_pages(self, query_builder: BuilderT, chunk_size: int) -> AsyncIterator[pd.DataFrame]:
+        """The result in pages of at most ``chunk_size`` rows, ordered by the group columns."""
+        keys = query_builder.get_group_columns()
+        if not keys:
+            # Without groups an aggregate query returns a single row
+            yield await self._fetch_query(query_builder, NULL_STATS)
+            return
+        last = None
+        while True:
+            query, args = self.page_query(query_builder, keys, last, chunk_size)
+            with source(type(query_builder).__name__):
+                df = await run_admitted(self.admission, INTERACTIVE, lambda: self.db_manager.fetch_frame(query, args),
+                                        lambda: self.db_manager.is_in_flight(query, args))
+            if len(df):
+                yield df
+            if len(df) < chunk_size:
+                return
+            row = df.iloc[-1]
+            last = tuple(row[key] for key in keys)
+
+    @staticmethod
+    def page_query(query_builder: BuilderT, keys: List[str], last: Tuple | None, chunk_size: int) -> Tuple[str, List]:
+        """
+        Query of the page after the group key ``last``, the first page without it.
+        NULL keys sort first in MySQL and SQLite and are compared with IS NULL, so a page may end on one.
+        """
+        builder = query_builder.copy()
+        if last is not None:
+            alternatives, args = [], []
+            for i, key in enumerate(keys):
+                terms = []
+                for column, value in zip(keys[:i], last):
+                    terms.append(f'{column} IS NULL' if value is None else f'{column} = %s')
+                    args.extend([] if value is None else [value])
+                terms.append(f'{key} IS NOT NULL' if last[i] is None else f'{key} > %s')
+                args.extend([] if last[i] is None else [last[i]])
+                alternatives.append(' AND '.join(terms))
+            builder.add_raw_where(f'({" OR ".join(f"({alternative})" for alternative in alternatives)})', args)
+        builder.sql_query.order_by = list(keys)
+        return builder.get_query() + ' LIMIT %s', list(builder.get_args()) + [chunk_size]
+
+    def _create_processor(self, query_builder: BuilderT, batched: bool = False,
+                          stats: FetchStats = NULL_STATS) -> Processor:
+        return Processor(query_builder, self, batched=batched, executor=self.executor, stats=stats,
+                         plays_store=self.plays_store, executors=self.metric_executors)
+
+    async def _process(self, query_builder: BuilderT, df: pd.DataFrame, batched: bool = False,
+                       stats: FetchStats = NULL_STATS, processor: Processor = None) -> pd.DataFrame:
+        p = processor or self._create_processor(query_builder, batched, stats)
         if query_builder.player_type == 'batter':
             return await p.calculate_batter_rows(df)
         elif query_builder.player_type == 'pitcher':
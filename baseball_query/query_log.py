@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import *
+
+# Builder class that issued the queries run in the current task, recorded with each slow query
+query_source: ContextVar[Optional[str]] = ContextVar('query_source', default=None)
+
+
+@contextmanager
+def source(name: str):
+    """Attribute the queries run inside the block to ``name``."""
+    token = query_source.set(name)
+    try:
+        yield
+    finally:
+        query_source.reset(token)
+
+
+class SlowQueryLog:
+    """Bounded log of the queries slower than a threshold, with an optional JSONL sink and EXPLAIN capture."""
+
+    def __init__(self, threshold: float = 1.0, max_entries: int = 1000, path: str = None, explain: bool = False):
+        """
+        :param threshold: Seconds a query has to take to be logged.
+        :param max_entries: Entries kept in memory, the oldest are dropped first.
+        :param path: Optional file every entry is appended to as a JSON line.
+        :param explain: Run EXPLAIN once for every logged query template and attach the plan.
+        """
+        self.threshold = threshold
+        self.path = path
+        self.explain = explain
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=max_entries)
+        # SQL template -> EXPLAIN rows, or the error raised by EXPLAIN
+        self.plans: Dict[str, List[Dict] | str] = {}
+        # Templates whose EXPLAIN is running in the background
+        self.explaining: Set[str] = set()
+        # JSON lines waiting for the background writer
+        self.pending_lines: List[str] = []
+        self.writer: asyncio.Task | None = None
+
+    def is_slow(self, duration: float) -> bool:
+        return duration >= self.threshold
+
+    def needs_plan(self, query: str) -> bool:
+        return (self.explain and query not in self.plans and query not in self.explaining
+                and query.lstrip()[:6].upper() == 'SELECT')
+
+    def record(self, query: str, params: Any, duration: float, rows: int, plan_pending: bool = False) -> Dict[str, Any]:
+        """
+        :param plan_pending: An EXPLAIN of the query is starting, the entry is written to the file by add_plan
+            once the plan is attached.
+        """
+        entry = {
+            'timestamp': time.time(),
+            'query': query,
+            'args': list(params.items()) if isinstance(params, dict) else list(params or []),
+            'duration': duration,
+            'rows': rows,
+            'source': query_source.get()
+        }
+        if query in self.plans:
+            entry['plan'] = self.plans[query]
+        self.entries.append(entry)
+        if plan_pending:
+            self.explaining.add(query)
+        else:
+            self._write(entry)
+        return entry
+
+    def add_plan(self, query: str, entry: Dict[str, Any], plan: List[Dict] | str):
+        self.explaining.discard(query)
+        self.plans[query] = plan
+        entry['plan'] = plan
+        self._write(entry)
+
+    def _write(self, entry: Dict[str, Any]):
+        """Queue the entry for the file, a background task appends the queued lines off the event loop."""
+        if self.path is None:
+            return
+        self.pending_lines.append(json.dumps(entry, default=str) + '\n')
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._append(self._take_lines())
+            return
+        if self.writer is None or self.writer.done():
+            self.writer = asyncio.ensure_future(self._write_pending())
+
+    async def _write_pending(self):
+        while self.pending_lines:
+            await asyncio.to_thread(self._append, self._take_lines())
+
+    def _take_lines(self) -> List[str]:
+        lines, self.pending_lines = self.pending_lines, []
+        return lines
+
+    def _append(self, lines: List[str]):
+        with open(self.path, 'a') as file:
+            file.writelines(lines)
+
+    async def flush(self):
+        """Wait until every recorded entry is in the file."""
+        while self.writer is not None and not self.writer.done():
+            await self.writer
+
+    def full_scans(self, table: str = 'all_plays') -> List[Dict[str, Any]]:
+        """Logged entries whose plan reads every row of ``table``."""
+        return [entry for entry in self.entries if isinstance(entry.get('plan'), list) and any(
+            row.get('table') == table and row.get('type') == 'ALL' for row in entry['plan'])]
+
+    def clear(self):
+        self.entries.clear()
+        self.plans.clear()
+        self.explaining.clear()
@@ -0,0 +1,265 @@
+import re
+import time
+from datetime import date, timedelta
+from typing import *
+from .abc import BaseDBManager, BaseCache, BaseQueryBuilder
+from .admission import AdmissionController, admitted
+from .queries import TotalsBuilder
+
+DATE_COLUMN = 'official_date'
+DATE_RANGE_WHERE = f'{DATE_COLUMN} BETWEEN %s AND %s'
+
+# Date ranges each rollup was refreshed for, written in the same transaction as the rollup rows, with the version
+# of the raw rows they were computed from
+RANGES_TABLE = 'rollup_ranges'
+VERSION_COLUMNS = (('row_count', 'BIGINT'), ('total', 'DOUBLE'))
+
+# Columns that are constant for a player on a day, the key of a rollup row
+DEFAULT_DIMENSIONS = ('player_id', 'name', 'team_name', 'league', 'season', DATE_COLUMN)
+
+# Functions that may be applied to the per-range sums, they never see a single rollup row
+OUTER_FUNCTIONS = {'ROUND', 'IF', 'IFNULL', 'COALESCE', 'NULLIF', 'GREATEST', 'LEAST'}
+SQL_KEYWORDS = {'AND', 'OR', 'NOT', 'NULL', 'IS', 'IN', 'BETWEEN', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'LIKE',
+                'ASC', 'DESC'}
+
+_TOKEN = re.compile(r"'(?:[^']|'')*'|%s|\b([A-Za-z_]\w*)\b(\s*\()?")
+_SUM = re.compile(r'\bSUM\(([^()]*)\)', re.IGNORECASE)
+_TERMS = re.compile(r'[+-]')
+
+
+class RollupManager:
+    """
+    Maintains per-player-per-day sums of the additive metrics of each totals table,
+    and points eligible date-range TotalsBuilder queries at them.
+    """
+
+    def __init__(self, db_manager: BaseDBManager, cache: BaseCache, tables: Sequence[str] = ('hitters', 'pitchers'),
+                 dimensions: Sequence[str] = DEFAULT_DIMENSIONS, admission: AdmissionController = None,
+                 ttl: float = 3600):
+        """
+        :param tables: Totals tables that get a ``<table>_daily`` rollup.
+        :param dimensions: Candidate key columns, those missing from a table are skipped.
+        :param admission: Controller of the client, refreshes and coverage loads take its BACKGROUND slots.
+        :param ttl: Seconds before the coverage of a table is reloaded and its ranges compared with the raw rows.
+        """
+        self.db_manager = db_manager
+        self.admission = admission
+        self.cache = cache
+        self.tables = tuple(tables)
+        self.dimensions = tuple(dimensions)
+        self.ttl = ttl
+        # table -> sorted, disjoint (first, last) official_date ranges held by its rollup and still current
+        self.coverage: Dict[str, List[Tuple[str, str]]] = {}
+        self.loaded_at: Dict[str, float] = {}
+        self.eligible: Dict[str, bool] = {}
+        self._eligible_metrics_dict = None
+
+    @staticmethod
+    def rollup_table(table: str) -> str:
+        return f'{table}_daily'
+
+    async def _columns(self, table: str) -> Tuple[List[str], List[str]]:
+        """Dimension and additive columns of ``table``."""
+        columns = (await self.cache.get_table_columns_dict()).get(table, [])
+        metrics_dict = await self.cache.get_metrics_dict()
+        dimensions = [column for column in self.dimensions if column in columns]
+        additive = [column for column in columns
+                    if column in metrics_dict and metrics_dict[column].is_additive and column not in dimensions]
+        return dimensions, additive
+
+    @staticmethod
+    def version_select(additive: Sequence[str]) -> str:
+        """Version of the raw rows of a range: their count and the sum of their additive columns."""
+        total = ' + '.join(f'COALESCE(SUM({column}), 0)' for column in additive) or '0'
+        return f'COUNT(*) AS row_count, ROUND({total}, 3) AS total'
+
+    async def refresh(self, table: str, start_date: str = None, end_date: str = None) -> int:
+        """
+        Recompute the rollup rows of ``table`` between the two dates, all of them without dates.
+        The rows and their covered range are replaced in one transaction, so readers see either the old or the
+        new rollup. Returns the number of rollup rows written.
+        """
+        dimensions, additive = await self._columns(table)
+        if DATE_COLUMN not in dimensions or 'player_id' not in dimensions or not additive:
+            raise ValueError(f'{table} has no {DATE_COLUMN}, player_id or additive metric to roll up')
+        rollup = self.rollup_table(table)
+        select = ', '.join(dimensions + [f'SUM({column}) AS {column}' for column in additive])
+        group_by = ', '.join(dimensions)
+        version = self.version_select(additive)
+        insert_range = f'INSERT INTO {RANGES_TABLE} (table_name, start_date, end_date, row_count, total) '
+        if start_date and end_date:
+            where, args = f' WHERE {DATE_RANGE_WHERE}', [start_date, end_date]
+            # Ranges inside the new one are superseded by it
+            ranges = [(f'DELETE FROM {RANGES_TABLE} WHERE table_name = %s AND start_date >= %s AND end_date <= %s',
+                       [table, start_date, end_date]),
+                      (insert_range + f'SELECT %s, %s, %s, {version} FROM {table} WHERE {DATE_RANGE_WHERE}',
+                       [table, start_date, end_date, start_date, end_date])]
+        else:
+            where, args = '', []
+            ranges = [(f'DELETE FROM {RANGES_TABLE} WHERE table_name = %s', [table]),
+                      (insert_range + f'SELECT %s, MIN({DATE_COLUMN}), MAX({DATE_COLUMN}), {version} FROM {table} '
+                       f'WHERE {DATE_COLUMN} IS NOT NULL', [table])]
+        async with admitted(self.admission):
+            await self.db_manager.execute_update(
+                f'CREATE TABLE IF NOT EXISTS {RANGES_TABLE} (table_name VARCHAR(64), start_date DATE, end_date DATE, '
+                f'{", ".join(f"{column} {data_type}" for column, data_type in VERSION_COLUMNS)})')
+            ranges_columns = {row['column_name'] for row in await self.db_manager.fetch_table_schema([RANGES_TABLE])}
+            for column, data_type in VERSION_COLUMNS:
+                if ranges_columns and column not in ranges_columns:
+                    # Created before ranges were versioned
+                    await self.db_manager.execute_update(f'ALTER TABLE {RANGES_TABLE} ADD COLUMN {column} {data_type}')
+            if not await self.db_manager.fetch_table_schema([rollup]):
+                await self.db_manager.execute_update(
+                    f'CREATE TABLE {rollup} AS SELECT {select} FROM {table} WHERE 1 = 0 GROUP BY {group_by}')
+                await self.db_manager.execute_update(
+                    f'CREATE INDEX idx_{rollup} ON {rollup} (player_id, {DATE_COLUMN})')
+            counts = await self.db_manager.execute_transaction([
+                (f'DELETE FROM {rollup}{where}', args),
+                (f'INSERT INTO {rollup} ({", ".join(dimensions + additive)}) '
+                 f'SELECT {select} FROM {table}{where} GROUP BY {group_by}', args)
+            ] + ranges)
+        await self.load_coverage([table])
+        return counts[1]
+
+    async def load_coverage(self, tables: Sequence[str] = None):
+        """
+        Read the date ranges the rollup tables were refreshed for. A range whose raw rows changed since, or that
+        has no version, is left out until it is refreshed again.
+        """
+        tables = tables or self.tables
+        placeholders = ', '.join(['%s'] * len(tables))
+        # Before taking the slot, the metadata loads take their own
+        versions = {table: self.version_select((await self._columns(table))[1]) for table in tables}
+        ranges = {table: [] for table in tables}
+        async with admitted(self.admission):
+            schema = await self.db_manager.fetch_table_schema([RANGES_TABLE])
+            if {row['column_name'] for row in schema} >= {column for column, _ in VERSION_COLUMNS}:
+                rows = await self.db_manager.fetch_all(
+                    f'SELECT table_name, start_date, end_date, row_count, total FROM {RANGES_TABLE} '
+                    f'WHERE table_name IN ({placeholders})', list(tables))
+            else:
+                rows = []
+            for row in rows:
+                if row['start_date'] is None or row['end_date'] is None or row['row_count'] is None:
+                    continue
+                table, start, end = row['table_name'], str(row['start_date'])[:10], str(row['end_date'])[:10]
+                current = await self.db_manager.fetch_all(
+                    f'SELECT {versions[table]} FROM {table} WHERE {DATE_RANGE_WHERE}', [start, end])
+                if current and self._same_version(row, current[0]):
+                    ranges[table].append((start, end))
+        now = time.time()
+        for table, table_ranges in ranges.items():
+            self.coverage[table] = self.merge_ranges(table_ranges)
+            self.loaded_at[table] = now
+
+    @staticmethod
+    def _same_version(stored: Dict, current: Dict) -> bool:
+        return (int(stored['row_count']) == int(current['row_count'])
+                and float(stored['total'] or 0) == float(current['total'] or 0))
+
+    async def _reload_expired(self, table: str):
+        """Reload the coverage of ``table`` once its ttl passed, it is dropped when the reload fails."""
+        if table not in self.tables or time.time() - self.loaded_at.get(table, 0.0) < self.ttl:
+            return
+        # Concurrent rewrites keep using the current coverage meanwhile instead of reloading too
+        self.loaded_at[table] = time.time()
+        try:
+            await self.load_coverage([table])
+        except Exception:
+            # Raw queries are always correct, retried after another ttl
+            self.coverage[table] = []
+
+    @staticmethod
+    def merge_ranges(ranges: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Sorted disjoint ranges covering the same days, adjacent or overlapping ranges are joined."""
+        merged: List[Tuple[str, str]] = []
+        for start, end in sorted(ranges):
+            if merged:
+                next_day = (date.fromisoformat(merged[-1][1]) + timedelta(days=1)).isoformat()
+                if start <= next_day:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                    continue
+            merged.append((start, end))
+        return merged
+
+    def covers(self, table: str, start: str, end: str) -> bool:
+        """Whether every day from ``start`` to ``end`` was rolled up for ``table``."""
+        return any(first <= start <= end <= last for first, last in self.coverage.get(table, ()))
+
+    async def rewrite(self, query_builder: BaseQueryBuilder) -> BaseQueryBuilder:
+        """A copy of ``query_builder`` reading the rollup table, or the builder itself when it isn't eligible."""
+        if not isinstance(query_builder, TotalsBuilder):
+            return query_builder
+        table = query_builder.sql_query.from_table
+        await self._reload_expired(table)
+        where_clauses = query_builder.get_where_clauses()
+        if not self.coverage.get(table) or DATE_RANGE_WHERE not in where_clauses:
+            return query_builder
+        # Args of the clauses before the date range shift its position
+        position = sum(where.count('%s') for where in where_clauses[:where_clauses.index(DATE_RANGE_WHERE)])
+        start, end = (str(arg)[:10] for arg in query_builder.get_args()[position:position + 2])
+        if not self.covers(table, start, end):
+            return query_builder
+        if not await self._is_eligible(query_builder, table):
+            return query_builder
+        rewritten = query_builder.copy()
+        rewritten.set_table(self.rollup_table(table))
+        return rewritten
+
+    async def _is_eligible(self, query_builder: TotalsBuilder, table: str) -> bool:
+        metrics_dict = await self.cache.get_metrics_dict()
+        if metrics_dict is not self._eligible_metrics_dict:
+            self.eligible.clear()
+            self._eligible_metrics_dict = metrics_dict
+        query = query_builder.get_query()
+        eligible = self.eligible.get(query)
+        if eligible is None:
+            dimensions, additive = await self._columns(table)
+            eligible = self.check_query(query_builder, set(dimensions), set(additive))
+            if len(self.eligible) >= 4096:
+                self.eligible.clear()
+            self.eligible[query] = eligible
+        return eligible
+
+    @classmethod
+    def check_query(cls, query_builder: TotalsBuilder, dimensions: Set[str], additive: Set[str]) -> bool:
+        """
+        Whether summing the rollup rows gives the same result as the raw rows: selects only use dimensions and
+        SUMs of sums and differences of additive columns, filters and groups only use dimensions.
+        A constant inside a SUM is rejected, it would be added once per rollup row instead of once per raw row.
+        """
+        sql_query = query_builder.sql_query
+        aliases = set()
+        for select in sql_query.select:
+            expression, alias = BaseQueryBuilder._parse_select(select)
+            if alias != expression:
+                expression = expression[:expression.rindex(' AS ')]
+                aliases.add(alias)
+            if not cls._check_expression(expression, dimensions, additive):
+                return False
+        if not all(cls._check_expression(where, dimensions, set()) for where in sql_query.where):
+            return False
+        if not set(sql_query.group_by) <= dimensions:
+            return False
+        return all(cls._check_expression(order, dimensions | aliases, set()) for order in sql_query.order_by)
+
+    @staticmethod
+    def _check_expression(expression: str, dimensions: Set[str], additive: Set[str]) -> bool:
+        def replace_sum(match):
+            nonlocal linear
+            linear = linear and all(term.strip() in additive for term in _TERMS.split(match.group(1)))
+            return '0'
+
+        linear = True
+        expression = _SUM.sub(replace_sum, expression)
+        if not linear:
+            return False
+        for name, call in _TOKEN.findall(expression):
+            if not name:
+                continue
+            if call:
+                if name.upper() not in OUTER_FUNCTIONS:
+                    return False
+            elif name not in dimensions and name.upper() not in SQL_KEYWORDS:
+                return False
+        return True
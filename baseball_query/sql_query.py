@@ -1,8 +1,36 @@
+import copy
+import re
+from functools import lru_cache
 from .errors import EmptyQueryError
-from typing import Self
+from typing import Self, Tuple
+
+
+@lru_cache(maxsize=4096)
+def render_sql(head: str, where: Tuple[str, ...], group_by: Tuple[str, ...], order_by: Tuple[str, ...]) -> str:
+    """Render the SQL text of a query shape, identical shapes share one string."""
+    query = head
+    if where:
+        query += f' WHERE {" AND ".join(where)}'
+    if group_by:
+        query += f' GROUP BY {", ".join(group_by)}'
+    if order_by:
+        query += f' ORDER BY {", ".join(order_by)}'
+    return query
+
+
+def to_prepared_sql(query: str) -> str:
+    """Turn a pyformat query into the ``?`` placeholder syntax of PREPARE."""
+    return re.sub(r'%([%s])', lambda match: '?' if match.group(1) == 's' else '%', query)
+
 
 class SQLQuery:
-    """Lightweight helper for composing SQL statements."""
+    """
+    Lightweight helper for composing SQL statements.
+    The rendered SQL is cached until a clause changes, so change clauses through the add_* methods
+    or by assigning the attributes, not by mutating the lists in place.
+    """
+
+    _CLAUSES = ('select', 'from_table', 'where', 'group_by', 'order_by')
 
     def __init__(self):
         self.select = []
@@ -11,9 +39,20 @@ class SQLQuery:
         self.group_by = []
         self.order_by = []
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self._CLAUSES:
+            super().__setattr__('_rendered', None)
+            if name == 'select':
+                super().__setattr__('_select_set', set(value))
+            elif name == 'group_by':
+                super().__setattr__('_group_by_set', set(value))
+
     def add_select(self, column: str) -> Self:
-        if column not in self.select:
+        if column not in self._select_set:
             self.select.append(column)
+            self._select_set.add(column)
+            self._rendered = None
         return self
 
     def set_from_table(self, table: str) -> Self:
@@ -22,41 +61,44 @@ class SQLQuery:
 
     def add_where(self, condition: str) -> Self:
         self.where.append(condition)
+        self._rendered = None
         return self
 
     def add_group_by(self, column: str) -> Self:
-        if column not in self.group_by:
+        if column not in self._group_by_set:
             self.group_by.append(column)
+            self._group_by_set.add(column)
+            self._rendered = None
         return self
 
     def add_order_by(self, column: str) -> Self:
         self.order_by.append(column)
+        self._rendered = None
         return self
 
     def build_query(self) -> str:
+        if self._rendered is None:
+            self._rendered = self._render()
+        return self._rendered
+
+    def _render(self) -> str:
         if not self.from_table:
             raise EmptyQueryError('FROM clause is missing.')
         if len(self.select) == 0:
             raise EmptyQueryError('SELECT clause is missing.')
-        query = f'SELECT {", ".join(self.select)} FROM {self.from_table}'
-        if self.where:
-            query += f' WHERE {" AND ".join(self.where)}'
-        if self.group_by:
-            query += f' GROUP BY {", ".join(self.group_by)}'
-        if self.order_by:
-            query += f' ORDER BY {", ".join(self.order_by)}'
-        return query
+        head = f'SELECT {", ".join(self.select)} FROM {self.from_table}'
+        return render_sql(head, tuple(self.where), tuple(self.group_by), tuple(self.order_by))
 
     def __str__(self):
         return self.build_query()
 
     def copy(self) -> 'SQLQuery':
-        new_query = SQLQuery()
+        new_query = copy.copy(self)  # keeps the subclass and its attributes
         new_query.select = self.select[:]  # shallow copy of list
-        new_query.from_table = self.from_table  # str, immutable
         new_query.where = self.where[:]  # shallow copy
         new_query.group_by = self.group_by[:]  # shallow copy
         new_query.order_by = self.order_by[:]  # shallow copy
+        new_query._rendered = self._rendered  # same clauses, same SQL
         return new_query
 
 
@@ -87,12 +129,5 @@ class BaseStrSQLQuery(SQLQuery):
             columns.append(''.join(current).strip())
         self.select = columns
 
-    def build_query(self) -> str:
-        query = self.base_query
-        if self.where:
-            query += f' WHERE {" AND ".join(self.where)}'
-        if self.group_by:
-            query += f' GROUP BY {", ".join(self.group_by)}'
-        if self.order_by:
-            query += f' ORDER BY {", ".join(self.order_by)}'
-        return query
+    def _render(self) -> str:
+        return render_sql(self.base_query, tuple(self.where), tuple(self.group_by), tuple(self.order_by))
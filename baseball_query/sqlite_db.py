@@ -0,0 +1,281 @@
+import asyncio
+import math
+import re
+import sqlite3
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import *
+from .abc import BaseDBManager, BaseCache
+from .admission import AdmissionController, admitted
+from .errors import QueryExecutionError
+from .frames import frame_from_columns, check_unique_columns
+from .instrumentation import FetchStats, NULL_STATS
+
+# Everything the query client reads: the stats tables plus the metric metadata and xwOBA lookup
+SNAPSHOT_TABLES = BaseCache.get_tables() + ('metrics', 'batted_ball_probabilities')
+
+SNAPSHOT_INDEXES = {
+    'all_plays': (('season', 'batter_id'), ('season', 'pitcher_id')),
+    'hitters': (('season',),),
+    'pitchers': (('season',),),
+    'fielders': (('season',),)
+}
+
+_QUOTED = re.compile(r"('(?:[^']|'')*')")
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%([%s])')
+
+
+def _placeholder(match: re.Match) -> str:
+    if match.group(1):
+        return ':' + match.group(1)
+    return '?' if match.group(2) == 's' else '%'
+
+
+@lru_cache(maxsize=4096)
+def to_sqlite_sql(query: str) -> str:
+    """
+    Translate the MySQL dialect of the builders to SQLite.
+    ``%s`` placeholders become ``?``, ``%(name)s`` become ``:name``, and ``/`` is made a real division,
+    SQLite truncates integer quotients.
+    """
+    parts = _QUOTED.split(_PLACEHOLDER.sub(_placeholder, query))
+    for i in range(0, len(parts), 2):
+        parts[i] = parts[i].replace('/', '* 1.0 /')
+    return ''.join(parts)
+
+
+def _if(condition, true_value, false_value):
+    return true_value if condition else false_value
+
+
+def _concat(*values):
+    return None if None in values else ''.join(map(str, values))
+
+
+def _greatest(*values):
+    return None if None in values else max(values)
+
+
+def _least(*values):
+    return None if None in values else min(values)
+
+
+# MySQL functions used in metric SQL that SQLite lacks or names differently
+MYSQL_FUNCTIONS = (('IF', 3, _if), ('CONCAT', -1, _concat), ('GREATEST', -1, _greatest), ('LEAST', -1, _least))
+
+
+def sqlite_type(data_type: str) -> str:
+    """Column affinity for a MySQL data type."""
+    data_type = data_type.lower()
+    if 'int' in data_type or data_type == 'bool':
+        return 'INTEGER'
+    if any(name in data_type for name in ('dec', 'float', 'double', 'real', 'numeric')):
+        return 'REAL'
+    return 'TEXT'
+
+
+def to_sqlite_value(value: Any) -> Any:
+    """Python value SQLite can bind, missing values become NULL."""
+    if hasattr(value, 'item'):
+        # numpy scalars
+        value = value.item()
+    if value is None or isinstance(value, (str, int, bytes)):
+        return value
+    if isinstance(value, float):
+        return None if math.isnan(value) else value
+    if isinstance(value, Decimal):
+        return float(value)
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def to_sqlite_params(params: Tuple | Dict | List = None) -> Tuple | Dict:
+    """Values to bind for to_sqlite_sql, a dict for named placeholders."""
+    if isinstance(params, dict):
+        return {name: to_sqlite_value(value) for name, value in params.items()}
+    return tuple(map(to_sqlite_value, params or ()))
+
+
+class SQLiteDBManager(BaseDBManager):
+    """Runs the builders' SQL against a local SQLite snapshot, for offline work and benchmarks."""
+
+    def __init__(self, path: str, max_workers: int = 4, read_only: bool = True):
+        """
+        :param path: SQLite file, as written by export_sqlite.
+        :param max_workers: Threads running queries, each with its own connection.
+        :param read_only: Open the file read-only, execute_update is refused by SQLite then.
+        """
+        self.path = path
+        self.max_workers = max_workers
+        self.read_only = read_only
+        self.executor: ThreadPoolExecutor | None = None
+        self.local = threading.local()
+        self.connections: List[sqlite3.Connection] = []
+        self.lock = threading.Lock()
+
+    async def initialize_pool(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='sqlite')
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            if self.read_only:
+                connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            else:
+                connection = sqlite3.connect(self.path, check_same_thread=False)
+            for name, arity, function in MYSQL_FUNCTIONS:
+                connection.create_function(name, arity, function, deterministic=True)
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return connection
+
+    async def _run(self, function: Callable, *args) -> Any:
+        await self.initialize_pool()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def _execute(self, query: str, params: Tuple | Dict | List = None) -> Tuple[List[str], List[Tuple]]:
+        try:
+            cursor = self._connection().execute(to_sqlite_sql(query), to_sqlite_params(params))
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description or ()]
+            check_unique_columns(columns)
+        except (sqlite3.Error, ValueError) as e:
+            raise QueryExecutionError(message=str(e), query1=query)
+        return columns, rows
+
+    async def fetch_all(self, query: str, params: Tuple | Dict | List = None) -> List[Dict]:
+        columns, rows = await self._run(self._execute, query, params)
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def fetch_frame(self, query: str, params: Tuple | Dict | List = None, dtypes: Dict[str, str] = None,
+                          stats: FetchStats = NULL_STATS) -> pd.DataFrame:
+        with stats.stage('sql_execute'):
+            columns, rows = await self._run(self._execute, query, params)
+        with stats.stage('frame_build'):
+            return frame_from_columns(columns, rows, dtypes)
+
+    def _execute_update(self, query: str, params: Tuple | Dict | List = None) -> int:
+        connection = self._connection()
+        try:
+            cursor = connection.execute(to_sqlite_sql(query), to_sqlite_params(params))
+            connection.commit()
+        except sqlite3.Error as e:
+            raise QueryExecutionError(message=str(e), query1=query)
+        return cursor.rowcount
+
+    async def execute_update(self, query: str, params: Tuple | Dict | List = None) -> int:
+        return await self._run(self._execute_update, query, params)
+
+    def _execute_transaction(self, statements: Sequence[Tuple[str, Tuple | Dict | List | None]]) -> List[int]:
+        connection = self._connection()
+        counts = []
+        query = None
+        try:
+            # Commits on success and rolls back on error
+            with connection:
+                for query, params in statements:
+                    cursor = connection.execute(to_sqlite_sql(query), to_sqlite_params(params))
+                    counts.append(cursor.rowcount)
+        except sqlite3.Error as e:
+            raise QueryExecutionError(message=str(e), query1=query)
+        return counts
+
+    async def execute_transaction(self, statements: Sequence[Tuple[str, Tuple | Dict | List | None]]) -> List[int]:
+        return await self._run(self._execute_transaction, statements)
+
+    async def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections.clear()
+        self.local = threading.local()
+
+    async def get_column_values(self, query: str, column_name: str) -> List:
+        return [row[column_name] for row in await self.fetch_all(query)]
+
+    async def fetch_metric_sqls(self, metric_names: List[str]) -> Dict[str, str]:
+        if not metric_names:
+            return {}
+        placeholders = ', '.join(['%s'] * len(metric_names))
+        query = f'SELECT metric_name, sql_value FROM metrics WHERE metric_name IN ({placeholders})'
+        results = await self.fetch_all(query, metric_names)
+        return {row['metric_name']: row['sql_value'] for row in results}
+
+    async def fetch_table_schema(self, tables: Sequence[str]) -> List[Dict]:
+        rows = []
+        for table in tables:
+            for column in await self.fetch_all(f'PRAGMA table_info({table})'):
+                rows.append({'table_name': table, 'column_name': column['name'], 'data_type': column['type'].lower()})
+        return rows
+
+    async def get_table_checksum(self, table: str) -> Any:
+        rows = await self.fetch_all(f'SELECT COUNT(*) AS row_count, MAX(rowid) AS max_rowid FROM {table}')
+        return f'{rows[0]["row_count"]}:{rows[0]["max_rowid"]}'
+
+
+async def export_sqlite(source: BaseDBManager, path: str, tables: Sequence[str] = SNAPSHOT_TABLES,
+                        indexes: Dict[str, Tuple[Tuple[str, ...], ...]] = None,
+                        chunk_size: int = 50000, admission: AdmissionController = None) -> Dict[str, int]:
+    """
+    Copy ``tables`` from ``source`` into the SQLite file at ``path``, replacing tables that already exist.
+    Rows are streamed in chunks so the export runs in bounded memory. Returns the row count of every table.
+    :param admission: Controller of a client sharing ``source``, each table's stream holds one of its BACKGROUND
+        slots.
+    """
+    indexes = SNAPSHOT_INDEXES if indexes is None else indexes
+    schema: Dict[str, List[Tuple[str, str]]] = {}
+    async with admitted(admission):
+        source_schema = await source.fetch_table_schema(tables)
+    for row in source_schema:
+        schema.setdefault(row['table_name'], []).append((row['column_name'], sqlite_type(row['data_type'])))
+    connection = sqlite3.connect(path, check_same_thread=False)
+    counts = {}
+    try:
+        for table in tables:
+            columns = schema.get(table)
+            if not columns:
+                continue
+            definitions = ', '.join(f'"{column}" {affinity}' for column, affinity in columns)
+            connection.execute(f'DROP TABLE IF EXISTS {table}')
+            connection.execute(f'CREATE TABLE {table} ({definitions})')
+            names = [column for column, _ in columns]
+            quoted = ', '.join(f'"{name}"' for name in names)
+            insert = f'INSERT INTO {table} ({quoted}) VALUES ({", ".join(["?"] * len(names))})'
+            counts[table] = 0
+            # Each chunk is inserted in a worker thread while the next one is read from the source
+            inserting = None
+            try:
+                async with admitted(admission):
+                    async for df in source.iter_chunks(f'SELECT * FROM {table}', chunk_size=chunk_size):
+                        rows = [[to_sqlite_value(value) for value in row]
+                                for row in df.reindex(columns=names).itertuples(index=False, name=None)]
+                        if inserting is not None:
+                            await inserting
+                        inserting = asyncio.ensure_future(asyncio.to_thread(connection.executemany, insert, rows))
+                        counts[table] += len(rows)
+            finally:
+                # The connection is closed on errors, the running insert must be done with it first
+                if inserting is not None:
+                    await inserting
+            for index_columns in indexes.get(table, ()):
+                if all(column in names for column in index_columns):
+                    connection.execute(f'CREATE INDEX idx_{table}_{"_".join(index_columns)} '
+                                       f'ON {table} ({", ".join(index_columns)})')
+            connection.commit()
+        connection.execute('ANALYZE')
+        connection.commit()
+    finally:
+        connection.close()
+    return counts
@@ -0,0 +1,146 @@
+"""
+Timed scenarios for the query and processing pipeline against synthetic data.
+
+    python -m benchmarks.run --scale 2 --latency 0.002 --output results.json
+    python -m benchmarks.run --backend sqlite
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from importlib import metadata
+from typing import *
+from baseball_query import BaseballQueryClient, PlaysBuilder, Processor, SQLQuery, SQLiteDBManager, export_sqlite
+from baseball_query.complex_metrics import COMPLEX_METRICS_DICT, PLAYS_COLUMN_DTYPES
+from baseball_query.frames import frame_from_records
+from .synthetic import generate_tables, InMemoryDBManager
+
+BATTER_METRICS = ['player_id', 'name', 'at_bats', 'hits', 'xwOBA', 'pulled_FB_percent', 'percentile_90']
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    return {
+        'repeat': len(durations),
+        'min': min(durations),
+        'median': statistics.median(durations),
+        'mean': statistics.fmean(durations)
+    }
+
+
+def time_sync(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+async def time_async(func: Callable[[], Awaitable], repeat: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+async def make_client(tables: Dict[str, List[Dict]], latency: float, backend: str,
+                      directory: str) -> BaseballQueryClient:
+    db_manager = InMemoryDBManager(tables, latency)
+    if backend == 'sqlite':
+        path = os.path.join(directory, 'snapshot.sqlite')
+        await export_sqlite(db_manager, path)
+        db_manager = SQLiteDBManager(path)
+    return BaseballQueryClient(db_manager=db_manager)
+
+
+def build_sql_query() -> str:
+    query = SQLQuery()
+    for column in ('hit_speeds', 'launch_angles', 'trajectories', 'bat_sides', 'hit_coordinates'):
+        query.add_select(column)
+    query.set_from_table('all_plays')
+    query.add_where('batter_id = %s').add_where('season = %s')
+    return query.build_query()
+
+
+async def run_benchmarks(scale: int, repeat: int, latency: float, backend: str = 'memory') -> Dict[str, Any]:
+    tables = generate_tables(players=50 * scale, plays_per_player=200)
+    with tempfile.TemporaryDirectory() as directory:
+        client = await make_client(tables, latency, backend, directory)
+        try:
+            results = await run_scenarios(client, tables, repeat)
+        finally:
+            await client.close()
+    try:
+        version = metadata.version('baseball-query')
+    except metadata.PackageNotFoundError:
+        version = 'unknown'
+    return {
+        'version': version,
+        'python': platform.python_version(),
+        'backend': backend,
+        'scale': scale,
+        'latency': latency,
+        'rows': {table: len(rows) for table, rows in tables.items()},
+        'results': results
+    }
+
+
+async def run_scenarios(client: BaseballQueryClient, tables: Dict[str, List[Dict]],
+                        repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    results['create_query'] = await time_async(lambda: client.create_query(list(BATTER_METRICS), 'batter'), repeat)
+    results['sql_query.build_query'] = time_sync(build_sql_query, repeat)
+
+    builder = await client.create_query(list(BATTER_METRICS), 'batter')
+    builder.add_year('2024')
+    totals_df = await client.fetch_data(builder, skip_processor=True)
+    for mode in ('apply_per_row', 'apply_batched'):
+        async def apply(mode=mode):
+            processor = Processor(builder, client, batched=mode == 'apply_batched')
+            metric_classes = list({COMPLEX_METRICS_DICT[m] for m in builder.python_metrics})
+            processor.metric_instances = await processor.async_initialize_metric_classes(metric_classes)
+            await getattr(processor, mode)(totals_df.copy())
+        results[f'processor.{mode}'] = await time_async(apply, repeat)
+
+    player_plays = [play for play in tables['all_plays'] if play['batter_id'] == 1]
+    temp_df = Processor._prepare_temp_df(frame_from_records(player_plays, PLAYS_COLUMN_DTYPES))
+    row = totals_df.iloc[0]
+    processor = Processor(builder, client)
+    for metric_class in sorted(set(COMPLEX_METRICS_DICT.values()), key=lambda cls: cls.__name__):
+        metric = (await processor.async_initialize_metric_classes([metric_class]))[0]
+        metric.add_row(row)
+        results[f'metric.{metric_class.__name__}'] = time_sync(lambda: metric.calculate(temp_df), repeat)
+
+    plays_builder = await client.create_query(['hit_speeds'], 'batter', PlaysBuilder)
+    plays_builder.add_year('2024')
+    results['fetch_data.plays'] = await time_async(
+        lambda: client.fetch_data(plays_builder, skip_processor=True), repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=int, default=1, help='50 players and 10,000 plays per unit')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every query')
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory',
+                        help='sqlite runs the queries on a SQLite snapshot of the synthetic tables')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    report = asyncio.run(run_benchmarks(args.scale, args.repeat, args.latency, args.backend))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+import asyncio
+import random
+import re
+from typing import *
+from baseball_query.abc import BaseDBManager, BaseQueryBuilder
+
+TEAMS = ('NYY', 'BOS', 'TOR', 'TB', 'BAL', 'CLE', 'DET', 'KC', 'MIN', 'CWS')
+TRAJECTORIES = ('fly_ball', 'ground_ball', 'line_drive', 'popup')
+
+METRICS = [
+    {'metric_name': 'player_id', 'sql_value': 'player_id', 'is_totals_batter': 1, 'is_totals_pitcher': 1,
+     'is_grouping': 1},
+    {'metric_name': 'name', 'sql_value': 'name', 'is_totals_batter': 1, 'is_totals_pitcher': 1, 'is_grouping': 1},
+    {'metric_name': 'at_bats', 'sql_value': 'SUM(at_bats) AS at_bats', 'is_totals_batter': 1},
+    {'metric_name': 'hits', 'sql_value': 'SUM(hits) AS hits', 'is_totals_batter': 1},
+    {'metric_name': 'base_on_balls', 'sql_value': 'SUM(base_on_balls) AS base_on_balls', 'is_totals_batter': 1},
+    {'metric_name': 'intentional_walks', 'sql_value': 'SUM(intentional_walks) AS intentional_walks',
+     'is_totals_batter': 1},
+    {'metric_name': 'hit_by_pitch', 'sql_value': 'SUM(hit_by_pitch) AS hit_by_pitch', 'is_totals_batter': 1},
+    {'metric_name': 'sac_flies', 'sql_value': 'SUM(sac_flies) AS sac_flies', 'is_totals_batter': 1},
+    {'metric_name': 'batters_faced', 'sql_value': 'SUM(batters_faced) AS batters_faced', 'is_totals_pitcher': 1},
+    {'metric_name': 'strike_outs', 'sql_value': 'SUM(strike_outs) AS strike_outs', 'is_totals_pitcher': 1},
+    {'metric_name': 'hit_speeds', 'sql_value': 'hit_speeds', 'is_all_plays': 1},
+    {'metric_name': 'launch_angles', 'sql_value': 'launch_angles', 'is_all_plays': 1},
+    {'metric_name': 'trajectories', 'sql_value': 'trajectories', 'is_all_plays': 1},
+    {'metric_name': 'bat_sides', 'sql_value': 'bat_sides', 'is_all_plays': 1},
+    {'metric_name': 'hit_coordinates', 'sql_value': 'hit_coordinates', 'is_all_plays': 1},
+    {'metric_name': 'xwOBA', 'is_python': 1, 'is_totals_batter': 1,
+     'dependencies': 'hit_speeds,launch_angles,at_bats,base_on_balls,intentional_walks,hit_by_pitch,sac_flies'},
+    {'metric_name': 'xwOBAcon', 'is_python': 1, 'is_totals_batter': 1, 'dependencies': 'xwOBA'},
+    {'metric_name': 'pulled_FB_percent', 'is_python': 1, 'is_totals_batter': 1,
+     'dependencies': 'trajectories,hit_speeds,hit_coordinates,bat_sides'},
+    {'metric_name': 'avg_ev_on_pulled_FB', 'is_python': 1, 'is_totals_batter': 1, 'dependencies': 'pulled_FB_percent'},
+    {'metric_name': 'percentile_90', 'is_python': 1, 'is_totals_batter': 1, 'is_totals_pitcher': 1,
+     'dependencies': 'hit_speeds'},
+]
+
+
+def generate_tables(players: int = 50, plays_per_player: int = 200, season: str = '2024',
+                    seed: int = 0) -> Dict[str, List[Dict]]:
+    """
+    Deterministic synthetic rows for the tables the query pipeline reads.
+    hitters and pitchers hold one row per player and season, so aggregating them is a no-op.
+    """
+    rnd = random.Random(seed)
+    hitters, pitchers, plays = [], [], []
+    for player_id in range(1, players + 1):
+        team = TEAMS[player_id % len(TEAMS)]
+        at_bats = rnd.randint(50, 650)
+        hitters.append({
+            'player_id': player_id, 'name': f'Batter {player_id}', 'team_name': team, 'season': season,
+            'at_bats': at_bats, 'hits': rnd.randint(at_bats // 6, at_bats // 3),
+            'base_on_balls': rnd.randint(5, 90), 'intentional_walks': rnd.randint(0, 10),
+            'hit_by_pitch': rnd.randint(0, 15), 'sac_flies': rnd.randint(0, 10)
+        })
+        pitchers.append({
+            'player_id': player_id, 'name': f'Pitcher {player_id}', 'team_name': team, 'season': season,
+            'batters_faced': rnd.randint(50, 900), 'strike_outs': rnd.randint(10, 250)
+        })
+        for _ in range(plays_per_player):
+            missing = rnd.random() < 0.1
+            plays.append({
+                'batter_id': player_id, 'batter_name': f'Batter {player_id}', 'team_batting': team,
+                'pitcher_id': rnd.randint(1, players), 'pitcher_name': None, 'team_fielding': rnd.choice(TEAMS),
+                'season': season,
+                'hit_speeds': None if missing else round(rnd.gauss(88, 14), 1),
+                'launch_angles': None if missing else round(rnd.gauss(12, 26), 1),
+                'trajectories': None if missing else rnd.choice(TRAJECTORIES),
+                'bat_sides': rnd.choice('LR'),
+                'hit_coordinates': None if missing else f'{rnd.uniform(0, 250):.2f}:{rnd.uniform(0, 220):.2f}'
+            })
+    for play in plays:
+        play['pitcher_name'] = f'Pitcher {play["pitcher_id"]}'
+    probabilities = []
+    for ev_bin in range(0, 122, 2):
+        for la_bin in range(-90, 91, 3):
+            single, double, triple = rnd.random() / 4, rnd.random() / 8, rnd.random() / 50
+            probabilities.append({
+                'ev_bin': ev_bin, 'la_bin': la_bin, 'prob_single': single, 'prob_double': double,
+                'prob_triple': triple, 'prob_home_run': rnd.random() / 10
+            })
+    return {
+        'metrics': [dict(metric) for metric in METRICS],
+        'hitters': hitters,
+        'pitchers': pitchers,
+        'fielders': [],
+        'league_averages': [],
+        'all_plays': plays,
+        'batted_ball_probabilities': probabilities
+    }
+
+
+# col = %s, col IN (%s, ...), col BETWEEN %s AND %s and col = <literal>
+WHERE_PATTERN = re.compile(r'(\w+) (?:(=) (%s|[\w.]+)|(IN) \(([%s, ]+)\)|(BETWEEN) %s AND %s)')
+
+
+class InMemoryDBManager(BaseDBManager):
+    """
+    Answers the queries built by SingleQueryBuilder from in-memory tables, with injectable latency.
+    Only projection and the filters of WHERE_PATTERN are evaluated, aggregates return the stored column.
+    Any other WHERE clause raises ValueError.
+    """
+
+    def __init__(self, tables: Dict[str, List[Dict]], latency: float = 0.0):
+        self.tables = tables
+        self.latency = latency
+        self.query_count = 0
+
+    async def initialize_pool(self):
+        pass
+
+    async def fetch_all(self, query: str, params: Optional[Tuple | Dict | List] = None) -> List[Dict]:
+        self.query_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.execute(query, list(params or []))
+
+    def execute(self, query: str, params: List) -> List[Dict]:
+        query = query.split(' ORDER BY ')[0].split(' GROUP BY ')[0]
+        select_part, _, rest = query.partition(' FROM ')
+        table, _, where = rest.partition(' WHERE ')
+        rows = self.tables[table.strip()]
+        if re.sub(r'\bAND\b', '', WHERE_PATTERN.sub('', where)).strip():
+            # An ignored clause would make a benchmark read the wrong rows
+            raise ValueError(f'Unsupported WHERE clause: {where}')
+        for match in WHERE_PATTERN.finditer(where):
+            column = match.group(1)
+            if match.group(2):
+                if match.group(3) == '%s':
+                    values = {params.pop(0)}
+                else:
+                    values = {int(match.group(3)) if match.group(3).isdigit() else match.group(3)}
+                rows = [row for row in rows if row.get(column) in values]
+            elif match.group(4):
+                count = match.group(5).count('%s')
+                values, params = set(params[:count]), params[count:]
+                rows = [row for row in rows if row.get(column) in values]
+            else:
+                low, high = params.pop(0), params.pop(0)
+                rows = [row for row in rows if low <= row.get(column) <= high]
+        columns = self._select_aliases(select_part[len('SELECT '):])
+        if columns == ['*']:
+            return [dict(row) for row in rows]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    @staticmethod
+    def _select_aliases(select_list: str) -> List[str]:
+        aliases, current, parens = [], [], 0
+        for char in select_list + ',':
+            if char == ',' and parens == 0:
+                aliases.append(BaseQueryBuilder._parse_select(''.join(current).strip())[1])
+                current = []
+                continue
+            current.append(char)
+            if char == '(':
+                parens += 1
+            elif char == ')':
+                parens -= 1
+        return aliases
+
+    async def execute_update(self, query: str, params: Optional[Tuple | Dict | List] = None) -> int:
+        return 0
+
+    async def close(self):
+        pass
+
+    async def get_column_values(self, query: str, column_name: str) -> List:
+        return [row[column_name] for row in await self.fetch_all(query)]
+
+    async def fetch_metric_sqls(self, metric_names: List[str]) -> Dict:
+        return {row['metric_name']: row.get('sql_value') for row in self.tables['metrics']
+                if row['metric_name'] in metric_names}
+
+    async def fetch_table_schema(self, tables: Sequence[str]) -> List[Dict]:
+        schema = []
+        for table in tables:
+            # Rows may omit columns, the type is the one of the first non-null value
+            types: Dict[str, str] = {}
+            for row in self.tables.get(table, []):
+                for column, value in row.items():
+                    if types.get(column, 'NoneType') == 'NoneType':
+                        types[column] = type(value).__name__
+            schema.extend({'table_name': table, 'column_name': column, 'data_type': data_type}
+                          for column, data_type in types.items())
+        return schema
+
+    async def get_table_checksum(self, table: str) -> Any:
+        return len(self.tables[table])
@@ -2,6 +2,16 @@ class DictCursor:
     """Minimal stand-in for aiomysql.DictCursor."""
     pass
 
+
+class Cursor:
+    """Minimal stand-in for aiomysql.Cursor."""
+    pass
+
+
+class SSCursor:
+    """Minimal stand-in for aiomysql.SSCursor."""
+    pass
+
 async def create_pool(**kwargs):
     class DummyPool:
         """Very small pool returning dummy connections."""
@@ -8,9 +8,15 @@ class DataFrame:
     def to_dict(self, orient='records'):
         return list(self.data)
 
+    def copy(self):
+        return DataFrame([dict(row) for row in self.data], columns=list(self.columns))
+
     def __len__(self):
         return len(self.data)
 
+    def memory_usage(self, index=True, deep=False):
+        return Series([8 * len(self.data) for _ in self.columns])
+
     def __getitem__(self, item):
         if isinstance(item, list):
             return DataFrame([{k: row[k] for k in item} for row in self.data])
@@ -42,6 +48,9 @@ class Series(list):
     def __add__(self, other):
         return Series([a + b for a, b in zip(self, other)])
 
+    def sum(self):
+        return sum(self)
+
 
 def merge(df1, df2, on=None, how='inner'):
     if on is None:
@@ -0,0 +1,90 @@
+import asyncio
+from baseball_query.admission import AdmissionController, INTERACTIVE, BACKGROUND
+
+
+def test_interactive_lane_admitted_first():
+    controller = AdmissionController(limit=2, reserved=1)
+    order = []
+
+    async def query(name, lane):
+        async with controller.slot(lane):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def run():
+        await controller.acquire(INTERACTIVE)
+        await controller.acquire(INTERACTIVE)
+        tasks = [asyncio.create_task(query('plays1', BACKGROUND)), asyncio.create_task(query('plays2', BACKGROUND))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(query('totals', INTERACTIVE)))
+        await asyncio.sleep(0)
+        assert controller.queue_depth() == 3
+        controller.release()
+        controller.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order[0] == 'totals'
+    assert sorted(order[1:]) == ['plays1', 'plays2']
+    stats = controller.stats()
+    assert stats['active'] == 0
+    assert stats['lanes'][BACKGROUND]['admitted'] == 2
+    assert stats['lanes'][INTERACTIVE]['queued'] == 0
+
+
+def test_background_lane_leaves_reserved_slot():
+    controller = AdmissionController(limit=2, reserved=1)
+
+    async def run():
+        await controller.acquire(BACKGROUND)
+        waiter = asyncio.create_task(controller.acquire(BACKGROUND))
+        await asyncio.sleep(0)
+        assert controller.queue_depth(BACKGROUND) == 1
+        await asyncio.wait_for(controller.acquire(INTERACTIVE), 1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.queue_depth() == 0
+        assert controller.active == 2
+
+    asyncio.run(run())
+
+
+def test_waiter_cancelled_before_release_raises_cancelled():
+    controller = AdmissionController(limit=1)
+
+    async def run():
+        await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        # The release drops the cancelled waiter before its task handles the cancellation
+        controller.release()
+        results = await asyncio.gather(waiter, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert controller.active == 0 and controller.queue_depth() == 0
+
+    asyncio.run(run())
+
+
+def test_client_sizes_admission_by_injected_backend():
+    from baseball_query.query_engine import BaseballQueryClient
+    from baseball_query.sqlite_db import SQLiteDBManager
+
+    client = BaseballQueryClient(pool_size=10, db_manager=SQLiteDBManager(':memory:', max_workers=3))
+    assert client.admission.limit == 3
+
+
+def test_metadata_loads_take_background_slots():
+    from baseball_query.cache_manager import ConstantsCache
+
+    controller = AdmissionController(limit=1)
+
+    class SlotCheckingDBManager:
+        async def fetch_all(self, query, params=None):
+            assert controller.active == 1
+            return [{'metric_name': 'hits'}]
+
+    cache = ConstantsCache(SlotCheckingDBManager(), admission=controller)
+    metrics = asyncio.run(cache.get_metrics_dict())
+    assert list(metrics) == ['hits']
+    assert controller.admitted[BACKGROUND] == 1 and controller.active == 0
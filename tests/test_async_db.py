@@ -0,0 +1,257 @@
+import asyncio
+from baseball_query.async_db import DBManager, to_prepared_sql
+
+
+class FakeCursor:
+    """Cursor recording executed statements on its connection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = [('hits',)]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, query, params=None):
+        self.connection.executed.append((query, params))
+
+    async def fetchall(self):
+        return self.connection.rows
+
+
+class FakeConnection:
+    """Connection holding canned rows and the statements run on it."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def cursor(self, *args):
+        return FakeCursor(self)
+
+
+class FakePool:
+    """Pool handing out a single shared connection."""
+
+    def __init__(self, rows):
+        self.connection = FakeConnection(rows)
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return pool.connection
+
+            async def __aexit__(self, *exc):
+                pass
+
+        return Acquire()
+
+
+def make_manager(rows, **kwargs):
+    db = DBManager({}, **kwargs)
+    db.pool = FakePool(rows)
+    return db
+
+
+def test_to_prepared_sql():
+    assert to_prepared_sql("SELECT a FROM t WHERE b = %s AND c LIKE 'x%%'") == \
+        "SELECT a FROM t WHERE b = ? AND c LIKE 'x%'"
+
+
+def test_repeated_template_uses_prepared_statement():
+    db = make_manager([{'hits': 1}], prepared_statements=True, prepare_threshold=2)
+    query = 'SELECT hits FROM all_plays WHERE batter_id = %s'
+
+    async def run():
+        for batter_id in (1, 2, 3):
+            assert await db.fetch_all(query, [batter_id]) == [{'hits': 1}]
+
+    asyncio.run(run())
+    assert db.pool.connection.executed == [
+        (query, [1]),
+        ('PREPARE bq_stmt_0 FROM %s', ('SELECT hits FROM all_plays WHERE batter_id = ?',)),
+        ('SET @bq_p0 = %s', [2]),
+        ('EXECUTE bq_stmt_0 USING @bq_p0', None),
+        ('SET @bq_p0 = %s', [3]),
+        ('EXECUTE bq_stmt_0 USING @bq_p0', None),
+    ]
+
+
+def test_prepared_statements_evicted_per_connection():
+    db = make_manager([], prepared_statements=True, prepare_threshold=1, max_prepared_statements=1)
+
+    async def run():
+        await db.fetch_all('SELECT a FROM t')
+        await db.fetch_all('SELECT b FROM t')
+
+    asyncio.run(run())
+    executed = [query for query, _ in db.pool.connection.executed]
+    assert executed == ['PREPARE bq_stmt_0 FROM %s', 'EXECUTE bq_stmt_0',
+                        'DEALLOCATE PREPARE bq_stmt_0', 'PREPARE bq_stmt_1 FROM %s', 'EXECUTE bq_stmt_1']
+
+
+def test_slow_query_log_records_and_explains_once(tmp_path):
+    import json
+    from baseball_query.query_log import SlowQueryLog, source
+
+    path = tmp_path / 'slow.jsonl'
+    log = SlowQueryLog(threshold=0, max_entries=2, path=str(path), explain=True)
+    db = make_manager([{'hits': 1}], slow_query_log=log)
+    query = 'SELECT hits FROM all_plays WHERE batter_id = %s'
+
+    async def run():
+        with source('PlaysBuilder'):
+            for batter_id in (1, 2, 3):
+                await db.fetch_all(query, [batter_id])
+        # EXPLAIN and the file write happen after the results are returned
+        assert not path.exists()
+        await asyncio.gather(*db.background_tasks)
+        await log.flush()
+
+    asyncio.run(run())
+    explains = [q for q, _ in db.pool.connection.executed if q.startswith('EXPLAIN')]
+    assert explains == ['EXPLAIN ' + query]
+    assert [entry['args'] for entry in log.entries] == [[2], [3]]
+    assert log.entries[-1]['source'] == 'PlaysBuilder'
+    assert log.entries[-1]['rows'] == 1
+    assert log.plans[query] == [{'hits': 1}]
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == 3 and all(line['query'] == query for line in lines)
+    assert [line['plan'] for line in lines if line['args'] == [1]] == [[{'hits': 1}]]
+
+
+def test_slow_query_log_threshold():
+    from baseball_query.query_log import SlowQueryLog
+
+    log = SlowQueryLog(threshold=60)
+    db = make_manager([{'hits': 1}], slow_query_log=log)
+    asyncio.run(db.fetch_all('SELECT hits FROM hitters'))
+    assert not log.entries and not log.plans
+
+
+def test_identical_concurrent_fetches_are_coalesced():
+    db = make_manager([{'hits': 1}], coalesce=True)
+    query = 'SELECT hits FROM all_plays WHERE batter_id = %s'
+
+    class SlowCursor(FakeCursor):
+        async def execute(self, query, params=None):
+            await asyncio.sleep(0.01)
+            await super().execute(query, params)
+
+    db.pool.connection.cursor = lambda *args: SlowCursor(db.pool.connection)
+
+    async def run():
+        return await asyncio.gather(db.fetch_all(query, [1]), db.fetch_all(query, [1]), db.fetch_all(query, [2]),
+                                    db.fetch_all(query, [1], coalesce=False))
+
+    first, second, other, uncoalesced = asyncio.run(run())
+    assert first == second == other == uncoalesced == [{'hits': 1}]
+    assert first is not second and first[0] is not second[0]
+    assert len(db.pool.connection.executed) == 3
+    assert db.coalesced_hits == 1
+    assert not db.in_flight
+
+
+def test_coalesced_callers_get_independent_copies():
+    db = make_manager([], coalesce=True)
+    query = 'SELECT hits FROM all_plays'
+
+    class SlowCursor(FakeCursor):
+        async def execute(self, query, params=None):
+            await asyncio.sleep(0.01)
+
+        async def fetchall(self):
+            return [{'hits': 1}]
+
+    db.pool.connection.cursor = lambda *args: SlowCursor(db.pool.connection)
+
+    async def first_caller():
+        rows = await db.fetch_all(query)
+        rows[0]['hits'] = 999
+        return rows
+
+    async def run():
+        return await asyncio.gather(first_caller(), db.fetch_all(query))
+
+    first, joiner = asyncio.run(run())
+    assert first == [{'hits': 999}]
+    assert joiner == [{'hits': 1}]
+
+
+def test_duplicate_result_columns_raise_query_error():
+    import pytest
+    from baseball_query.errors import QueryExecutionError
+
+    db = make_manager([(1, 2)])
+    query = 'SELECT * FROM (SELECT hits FROM a) AS q1 JOIN (SELECT hits FROM b) AS q2'
+
+    class JoinCursor(FakeCursor):
+        def __init__(self, connection):
+            super().__init__(connection)
+            self.description = [('hits',), ('hits',)]
+
+    db.pool.connection.cursor = lambda *args: JoinCursor(db.pool.connection)
+    with pytest.raises(QueryExecutionError, match='hits') as info:
+        asyncio.run(db.fetch_frame(query))
+    assert info.value.query1 == query
+
+
+def test_coalesced_fetches_take_one_slot():
+    from baseball_query.admission import AdmissionController, INTERACTIVE, run_admitted
+
+    db = make_manager([{'hits': 1}], coalesce=True)
+    controller = AdmissionController(limit=1)
+    query = 'SELECT hits FROM hitters'
+
+    class SlowCursor(FakeCursor):
+        async def execute(self, query, params=None):
+            await asyncio.sleep(0.01)
+            await super().execute(query, params)
+
+    db.pool.connection.cursor = lambda *args: SlowCursor(db.pool.connection)
+
+    def fetch():
+        return run_admitted(controller, INTERACTIVE, lambda: db.fetch_all(query),
+                            lambda: db._coalesce_key(None, 'all', query) in db.in_flight)
+
+    async def run():
+        return await asyncio.gather(fetch(), fetch(), fetch())
+
+    assert asyncio.run(run()) == [[{'hits': 1}]] * 3
+    # The callers queued behind the first one join it once admitted instead of running the query again
+    assert len(db.pool.connection.executed) == 1
+    assert controller.admitted[INTERACTIVE] == 1 and db.coalesced_hits == 2
+
+
+def test_coalesced_client_fetches_take_one_slot():
+    import pytest
+    pytest.importorskip('pandas', minversion='1.0')
+    from baseball_query.abc import DBMetric
+    from baseball_query.admission import INTERACTIVE
+    from baseball_query.queries import TotalsBuilder
+    from baseball_query.query_engine import BaseballQueryClient
+
+    db = make_manager([(1,)], pool_size=1, coalesce=True)
+
+    class SlowCursor(FakeCursor):
+        async def execute(self, query, params=None):
+            await asyncio.sleep(0.01)
+            await super().execute(query, params)
+
+    db.pool.connection.cursor = lambda *args: SlowCursor(db.pool.connection)
+    client = BaseballQueryClient(db_manager=db)
+    builder = TotalsBuilder('batter')
+    builder.add_select(DBMetric({'metric_name': 'hits', 'sql_value': 'hits', 'is_totals_batter': 1}))
+
+    async def run():
+        return await asyncio.gather(*(client.fetch_data(builder.copy(), skip_processor=True) for _ in range(3)))
+
+    frames = asyncio.run(run())
+    assert [df.iloc[0]['hits'] for df in frames] == [1, 1, 1]
+    assert len(db.pool.connection.executed) == 1
+    assert client.admission.admitted[INTERACTIVE] == 1 and db.coalesced_hits == 2
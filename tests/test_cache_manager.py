@@ -0,0 +1,196 @@
+import asyncio
+import json
+from baseball_query.cache_manager import ConstantsCache, SNAPSHOT_FORMAT
+
+
+class CountingDBManager:
+    """Records every query and returns canned rows."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    async def fetch_all(self, query, params=None):
+        self.queries.append(query)
+        return self.rows
+
+
+def test_batted_ball_probabilities_cached_until_refresh():
+    rows = [{'ev_bin': 90, 'la_bin': 12, 'prob_single': 0.3}]
+    db = CountingDBManager(rows)
+    cache = ConstantsCache(db)
+
+    async def run():
+        first = await cache.get_batted_ball_probabilities()
+        second = await cache.get_batted_ball_probabilities()
+        cache.refresh('BATTED_BALL_PROBABILITIES')
+        third = await cache.get_batted_ball_probabilities()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == second == third == rows
+    assert db.queries == ['SELECT * FROM batted_ball_probabilities'] * 2
+
+
+def test_reference_ttl_expires_entries():
+    db = CountingDBManager([])
+    cache = ConstantsCache(db, reference_ttl=0)
+    asyncio.run(cache.get_batted_ball_probabilities())
+    asyncio.run(cache.get_batted_ball_probabilities())
+    assert len(db.queries) == 2
+
+
+def test_result_cache_lru_eviction_and_counters():
+    from baseball_query.cache_manager import ResultCache, estimate_size
+
+    rows = [{'hits': 1}]
+    cache = ResultCache(max_bytes=2 * estimate_size(rows), ttl=60, store='raw')
+    cache.set(('q1', ()), rows)
+    cache.set(('q2', ()), rows)
+    assert cache.get(('q1', ())) == rows  # q1 becomes most recently used
+    cache.set(('q3', ()), rows)
+    assert cache.get(('q2', ())) is None
+    assert cache.get(('q3', ())) == rows
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'evictions': 1, 'entries': 2,
+                             'bytes': 2 * estimate_size(rows)}
+
+
+def test_result_cache_ttl_expires_entries():
+    from baseball_query.cache_manager import ResultCache
+
+    cache = ResultCache(ttl=0)
+    cache.set(('q', ('2023',)), [])
+    assert cache.get(('q', ('2023',))) is None
+    assert cache.stats()['entries'] == 0
+
+
+class SlowDBManager(CountingDBManager):
+    """Counting manager that yields to the event loop before answering."""
+
+    async def fetch_all(self, query, params=None):
+        self.queries.append(query)
+        await asyncio.sleep(0.01)
+        return self.rows
+
+
+def test_concurrent_misses_share_one_load():
+    db = SlowDBManager([{'metric_name': 'hits', 'sql_value': 'hits'}])
+    cache = ConstantsCache(db)
+
+    async def run():
+        return await asyncio.gather(*[cache.get_metrics_dict() for _ in range(5)])
+
+    results = asyncio.run(run())
+    assert db.queries == ['SELECT * FROM metrics']
+    assert all(result is results[0] for result in results)
+
+
+def test_stale_while_revalidate_serves_old_value():
+    db = SlowDBManager([{'ev_bin': 90}])
+    cache = ConstantsCache(db, reference_ttl=60, stale_while_revalidate=True)
+    cache.cache['BATTED_BALL_PROBABILITIES'] = {'data': ['stale'], 'timestamp': 0}
+
+    async def run():
+        stale = await cache.get_batted_ball_probabilities()
+        await cache.loading['BATTED_BALL_PROBABILITIES']
+        fresh = await cache.get_batted_ball_probabilities()
+        return stale, fresh
+
+    stale, fresh = asyncio.run(run())
+    assert stale == ['stale']
+    assert fresh == [{'ev_bin': 90}]
+    assert len(db.queries) == 1
+
+
+class MetadataDBManager:
+    """Answers the metadata queries ConstantsCache issues."""
+
+    def __init__(self, checksum=1):
+        self.checksum = checksum
+        self.queries = []
+
+    async def fetch_all(self, query, params=None):
+        self.queries.append(query)
+        if query == 'SELECT * FROM metrics':
+            return [{'metric_name': 'OPS', 'is_python': 1, 'dependencies': 'OBP,SLG'}]
+        return []
+
+    async def fetch_table_schema(self, tables):
+        self.queries.append('information_schema')
+        return [{'table_name': table, 'column_name': column, 'data_type': data_type}
+                for table in ('hitters', 'all_plays')
+                for column, data_type in (('name', 'varchar'), ('season', 'int'))]
+
+    async def get_table_checksum(self, table):
+        self.queries.append(f'CHECKSUM TABLE {table}')
+        return self.checksum
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'metadata.json')
+    asyncio.run(ConstantsCache(MetadataDBManager(), snapshot_path=path).save_snapshot())
+
+    db = MetadataDBManager()
+    cache = ConstantsCache(db, snapshot_path=path)
+
+    async def run():
+        assert await cache.load_snapshot()
+        metrics = await cache.get_metrics_dict()
+        columns = await cache.get_table_columns_dict()
+        await cache.snapshot_task
+        return metrics, columns
+
+    metrics, columns = asyncio.run(run())
+    assert metrics['OPS'].dependencies == ['OBP', 'SLG']
+    assert columns['hitters'] == ['name', 'season']
+    assert db.queries == ['CHECKSUM TABLE metrics']
+
+
+def test_stale_snapshot_is_reloaded(tmp_path):
+    path = str(tmp_path / 'metadata.json')
+    asyncio.run(ConstantsCache(MetadataDBManager(checksum=1), snapshot_path=path).save_snapshot())
+
+    db = MetadataDBManager(checksum=2)
+    cache = ConstantsCache(db, snapshot_path=path)
+
+    async def run():
+        await cache.load_snapshot()
+        await cache.snapshot_task
+
+    asyncio.run(run())
+    assert 'SELECT * FROM metrics' in db.queries
+    with open(path) as file:
+        assert '"version": 2' in file.read()
+
+
+def test_unusable_snapshot_is_rewritten(tmp_path):
+    path = str(tmp_path / 'metadata.json')
+    old_format = {'version': 1, 'metrics': [], 'table_columns': {'hitters': ['name']}}
+    for content in (json.dumps(old_format), '{"version": 1, "metr'):
+        with open(path, 'w') as file:
+            file.write(content)
+        db = MetadataDBManager()
+        cache = ConstantsCache(db, snapshot_path=path)
+
+        async def run():
+            assert not await cache.load_snapshot()
+            await cache.snapshot_task
+
+        asyncio.run(run())
+        assert 'SELECT * FROM metrics' in db.queries
+        with open(path) as file:
+            assert json.load(file)['format'] == SNAPSHOT_FORMAT
+
+
+def test_schema_loaded_in_one_query_and_indexed():
+    db = MetadataDBManager()
+    cache = ConstantsCache(db)
+
+    async def run():
+        return await cache.get_table_columns_dict(), await cache.get_column_index()
+
+    columns, index = asyncio.run(run())
+    assert db.queries == ['information_schema']
+    assert columns['hitters'] == ['name', 'season']
+    assert columns['pitchers'] == []
+    assert [(info.table, info.data_type) for info in index['season']] == [('hitters', 'int'), ('all_plays', 'int')]
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+
+
+def real_libraries():
+    """numpy and pandas, the stubs lack the memory maps and categoricals the store is built on."""
+    np = pytest.importorskip('numpy', minversion='1.20')
+    pd = pytest.importorskip('pandas', minversion='1.0')
+    return np, pd
+
+
+def test_partition_round_trip(tmp_path):
+    np, pd = real_libraries()
+    from baseball_query.plays_store import PlaysPartition, write_partition
+
+    plays_df = pd.DataFrame({
+        'batter_id': [7, 3, 7, 3, 3],
+        'hit_speeds': [101.5, 88.0, 95.25, np.nan, 70.0],
+        'launch_angles': [12.0, -5.0, 30.0, 8.0, 45.0],
+        'trajectories': ['line_drive', 'ground_ball', None, 'fly_ball', 'popup'],
+        'bat_sides': ['L', 'R', 'L', 'R', 'R'],
+        'hit_coordinates': ['120.5:80.25', '100:150', None, '90.5:60', '']
+    })
+    path = str(tmp_path / 'batter')
+    write_partition(path, plays_df, 'batter_id', version={'row_count': 5})
+    partition = PlaysPartition(path)
+    assert partition.player_ids.tolist() == [3, 7]
+    assert partition.offsets.tolist() == [0, 3, 5]
+    assert partition.version == {'row_count': 5}
+
+    player_3 = partition.get(3)
+    # Each player keeps the order the database returned the plays in
+    assert player_3['hit_speeds'].tolist()[0] == 88.0 and np.isnan(player_3['hit_speeds'].tolist()[1])
+    assert player_3['launch_angles'].tolist() == [-5.0, 8.0, 45.0]
+    assert player_3['hc_x'].tolist()[:2] == [100.0, 90.5] and np.isnan(player_3['hc_x'].iloc[2])
+    assert player_3['hc_y'].tolist()[:2] == [150.0, 60.0]
+    assert player_3['bat_sides'].tolist() == ['R', 'R', 'R']
+
+    player_7 = partition.get(7)
+    assert player_7['trajectories'].iloc[0] == 'line_drive'
+    # A missing category is stored as code -1 and comes back as NaN
+    assert pd.isna(player_7['trajectories'].iloc[1])
+    assert np.isnan(player_7['hc_x'].iloc[1]) and player_7['hc_y'].iloc[0] == 80.25
+
+    for missing in (1, 5, 9):
+        assert partition.get(missing).empty
+        assert set(partition.get(missing).columns) == set(player_3.columns)
+
+
+def test_stale_season_not_served(tmp_path):
+    np, pd = real_libraries()
+    from baseball_query.plays_store import PlaysStore, export_plays_store
+
+    plays = [{'season': '2024', 'batter_id': 1, 'hit_speeds': 100.0, 'launch_angles': 20.0,
+              'trajectories': 'line_drive', 'bat_sides': 'L', 'hit_coordinates': '100:100'}]
+
+    class PlaysDBManager:
+        def __init__(self):
+            self.version_queries = 0
+
+        async def fetch_all(self, query, params=None):
+            self.version_queries += 1
+            return [{'row_count': len(plays), 'hit_speeds': sum(play['hit_speeds'] for play in plays),
+                     'launch_angles': sum(play['launch_angles'] for play in plays)}]
+
+        async def fetch_frame(self, query, params=None, dtypes=None):
+            return pd.DataFrame(plays).drop(columns='season')
+
+    db = PlaysDBManager()
+    asyncio.run(export_plays_store(db, str(tmp_path), ['2024'], player_types=('batter',)))
+    store = PlaysStore(str(tmp_path), ttl=3600)
+    assert store.covers('2024', 'batter', ['hit_speeds', 'hit_coordinates'])
+    assert asyncio.run(store.is_current(db, '2024', 'batter'))
+    assert asyncio.run(store.is_current(db, '2024', 'batter'))
+    # Checked once per ttl
+    assert db.version_queries == 2
+
+    plays[0]['hit_speeds'] = 90.0
+    store.checks.clear()
+    assert not asyncio.run(store.is_current(db, '2024', 'batter'))
+    assert not asyncio.run(store.is_current(db, '2024', 'pitcher'))
@@ -31,3 +31,125 @@ def test_ops_calculation():
     result = asyncio.run(processor.calculate_batter_rows(df))
     assert 'OPS' in result.columns
     assert result.iloc[0]['OPS'] == 0.8
+
+
+def test_batch_builder_filters_by_union_of_group_keys():
+    from baseball_query.abc import DBMetric
+    from baseball_query.query_engine import BaseballQueryClient
+
+    class FakeCache:
+        async def get_metrics_dict(self):
+            return {
+                'hit_speeds': DBMetric({'metric_name': 'hit_speeds', 'sql_value': 'hit_speeds', 'is_all_plays': 1}),
+                'percentile_90': DBMetric({'metric_name': 'percentile_90', 'is_python': 1,
+                                           'dependencies': 'hit_speeds'}),
+            }
+
+    class GroupedBuilder(DummyQueryBuilder):
+        python_metrics = ['percentile_90']
+
+        def get_group_columns(self):
+            return ['player_id']
+
+        def get_where_clauses(self):
+            return ['season = %s']
+
+        def get_args(self):
+            return ['2023']
+
+    client = BaseballQueryClient()
+    client.cache = FakeCache()
+    df = pd.DataFrame([{'player_id': 1}, {'player_id': 2}, {'player_id': 1}])
+    processor = Processor(GroupedBuilder(), client, batched=True)
+    builder = asyncio.run(processor._build_batch_builder(df))
+    assert builder.get_query() == ('SELECT hit_speeds, batter_id FROM all_plays '
+                                   'WHERE batter_id IN (%s, %s) AND season = %s')
+    assert builder.get_args() == [1, 2, '2023']
+
+
+def test_metrics_calculated_in_thread_workers():
+    import pytest
+    from baseball_query.abc import VectorizedMetric
+
+    class RowCount(VectorizedMetric):
+        def __init__(self, offset=0):
+            super().__init__('row_count', dependencies=())
+            self.offset = offset
+
+        def calculate(self, temp_df):
+            return {'row_count': len(temp_df) + self.offset}
+
+    processor = Processor(DummyQueryBuilder(), DummyFactory(), executor='thread', max_workers=2)
+    processor.pool_executor = processor._create_executor([(RowCount, (10,))])
+    try:
+        result = asyncio.run(processor._calculate_metrics(None, pd.DataFrame([{'a': 1}, {'a': 2}])))
+    finally:
+        processor.pool_executor.shutdown()
+    assert result == {'row_count': 12}
+    with pytest.raises(ValueError):
+        Processor(DummyQueryBuilder(), DummyFactory(), executor='gpu')
+
+
+def test_metric_executors_reuse_pools_per_metric_specs():
+    from baseball_query.complex_metrics import Percentile90
+    from baseball_query.processing import MetricExecutors
+
+    executors = MetricExecutors('thread', max_workers=1)
+    probabilities = [{'ev_bin': 90}]
+    first = executors.acquire([(Percentile90, (probabilities,))])
+    executors.release(first)
+    assert executors.acquire([(Percentile90, (probabilities,))]) is first
+    # Reloaded arguments replace the pool, the old one is shut down once released
+    second = executors.acquire([(Percentile90, ([{'ev_bin': 90}],))])
+    assert second is not first and first in executors.retired
+    executors.release(first)
+    assert not executors.retired
+    executors.shutdown()
+    assert not executors.pools
+
+
+def test_plays_store_used_only_for_season_queries_by_player():
+    from baseball_query.complex_metrics import Percentile90
+
+    class FakeStore:
+        def covers(self, season, player_type, columns):
+            return season == '2023' and set(columns) <= {'hit_speeds'}
+
+    class SeasonBuilder(DummyQueryBuilder):
+        group_columns = ['player_id', 'name']
+        where = [('season = %s', '2023'), ('name = %s', 'A')]
+
+        def get_group_columns(self):
+            return self.group_columns
+
+        def get_where_clauses(self):
+            return [where for where, _ in self.where]
+
+        def get_args(self):
+            return [arg for _, arg in self.where]
+
+    builder = SeasonBuilder()
+    processor = Processor(builder, DummyFactory(), plays_store=FakeStore())
+    processor.metric_instances = [Percentile90()]
+    assert processor._plays_store_season() == '2023'
+    builder.where = [('season = %s', '2024')]
+    assert processor._plays_store_season() is None
+    builder.where = [('season = %s', '2023'), ('league = %s', 'AL')]
+    assert processor._plays_store_season() is None
+    builder.where = [('season = %s', '2023')]
+    builder.group_columns = ['player_id', 'league']
+    assert processor._plays_store_season() is None
+
+
+def test_xwoba_lookup_table_built_once_per_probabilities():
+    import pytest
+    pytest.importorskip('numpy', minversion='1.20')
+    from baseball_query.complex_metrics import ExpectedWeightedOBA
+
+    probabilities = [{'ev_bin': 90, 'la_bin': 12, 'prob_single': 0.3, 'prob_double': 0.1, 'prob_triple': 0.0,
+                      'prob_home_run': 0.05}]
+    first, second = ExpectedWeightedOBA(probabilities), ExpectedWeightedOBA(probabilities)
+    assert first.lookup_table is second.lookup_table
+    assert (first.ev_offset, first.la_offset) == (45, 4)
+    reloaded = ExpectedWeightedOBA([dict(row) for row in probabilities])
+    assert reloaded.lookup_table is not first.lookup_table
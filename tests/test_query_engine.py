@@ -102,3 +102,202 @@ def test_get_combined_data_merge():
     df = asyncio.run(db.get_combined_data(qb1, qb2, merge_on=['id']))
     assert df.to_dict('records') == [{'id': 1, 'a': 'x', 'b': 'y'}]
 
+
+
+def test_stream_data_yields_chunks():
+    metrics_dict = {
+        'hits': DBMetric({'metric_name': 'hits', 'sql_value': 'hits', 'is_totals_batter': 1})
+    }
+    client = BaseballQueryClient()
+    client.db_manager = FakeDBManager([{'hits': h} for h in range(5)])
+    client.cache = FakeCache(metrics_dict)
+    import asyncio
+
+    async def collect():
+        builder = await client.create_query(['hits'], player_type='batter')
+        return [chunk async for chunk in client.stream_data(builder, chunk_size=2, skip_processor=True)]
+
+    chunks = asyncio.run(collect())
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[-1].iloc[0]['hits'] == 4
+
+
+def test_processed_stream_pages_with_keyset_queries():
+    metrics_dict = {
+        'player_id': DBMetric({'metric_name': 'player_id', 'sql_value': 'player_id', 'is_totals_batter': 1}),
+        'team_name': DBMetric({'metric_name': 'team_name', 'sql_value': 'team_name', 'is_totals_batter': 1}),
+        'hits': DBMetric({'metric_name': 'hits', 'sql_value': 'SUM(hits) AS hits', 'is_totals_batter': 1})
+    }
+    pages = [[{'player_id': 1, 'team_name': None, 'hits': 1}, {'player_id': 1, 'team_name': 'NYY', 'hits': 2}],
+             [{'player_id': 2, 'team_name': None, 'hits': 3}, {'player_id': 3, 'team_name': 'BOS', 'hits': 4}],
+             [{'player_id': 4, 'team_name': 'NYY', 'hits': 5}]]
+
+    class PagedDBManager(FakeDBManager):
+        async def fetch_all(self, query, params=None):
+            self.queries.append((query, params))
+            return pages[len(self.queries) - 1]
+
+    client = BaseballQueryClient()
+    client.db_manager = PagedDBManager([])
+    client.cache = FakeCache(metrics_dict)
+    import asyncio
+
+    async def collect():
+        builder = await client.create_query(['player_id', 'team_name', 'hits'], player_type='batter')
+        builder.group_by(['player_id', 'team_name']).add_year('2024')
+        builder.order_by('hits')
+        client._process = lambda builder, df, processor=None: asyncio.sleep(0, df)
+        return [chunk async for chunk in client.stream_data(builder, chunk_size=2)]
+
+    chunks = asyncio.run(collect())
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    head = 'SELECT player_id, team_name, SUM(hits) AS hits FROM hitters WHERE season = %s'
+    tail = 'GROUP BY player_id, team_name ORDER BY player_id, team_name LIMIT %s'
+    assert client.db_manager.queries == [
+        (f'{head} {tail}', ['2024', 2]),
+        (f'{head} AND ((player_id > %s) OR (player_id = %s AND team_name > %s)) {tail}', ['2024', 1, 1, 'NYY', 2]),
+        (f'{head} AND ((player_id > %s) OR (player_id = %s AND team_name > %s)) {tail}', ['2024', 3, 3, 'BOS', 2]),
+    ]
+    last = BaseballQueryClient.page_query(asyncio.run(client.create_query(['hits'], 'batter')).group_by(
+        ['player_id', 'team_name']), ['player_id', 'team_name'], (2, None), 10)
+    assert 'WHERE ((player_id > %s) OR (player_id = %s AND team_name IS NOT NULL))' in last[0]
+    assert last[1] == [2, 2, 10]
+
+
+def test_fetch_data_result_cache():
+    from baseball_query.cache_manager import ResultCache
+
+    metrics_dict = {
+        'hits': DBMetric({'metric_name': 'hits', 'sql_value': 'hits', 'is_totals_batter': 1})
+    }
+    client = BaseballQueryClient(result_cache=ResultCache(store='processed'))
+    client.db_manager = FakeDBManager([{'hits': 5}])
+    client.cache = FakeCache(metrics_dict)
+    import asyncio
+    builder = asyncio.run(client.create_query(['hits'], player_type='batter'))
+    first = asyncio.run(client.fetch_data(builder, skip_processor=True))
+    second = asyncio.run(client.fetch_data(builder, skip_processor=True))
+    assert first.to_dict('records') == second.to_dict('records') == [{'hits': 5}]
+    assert len(client.db_manager.queries) == 1
+    assert client.result_cache.stats()['hits'] == 1
+
+
+def test_combined_query_pushes_join_down():
+    from baseball_query.async_db import DBManager
+    from baseball_query.queries import SingleQueryBuilder
+    from baseball_query.sql_query import SQLQuery
+
+    qb1 = SingleQueryBuilder('batter', SQLQuery())
+    qb1.set_table('hitters')
+    qb1.sql_query.add_select('player_id')
+    qb1.add_dynamic_where('season', '2023')
+
+    qb2 = SingleQueryBuilder('pitcher', SQLQuery())
+    qb2.set_table('pitchers')
+    qb2.sql_query.add_select('player_id')
+    qb2.add_dynamic_where('season', '2024')
+
+    query, args = DBManager.combined_query(qb1, qb2, ['player_id'])
+    assert query == ('SELECT * FROM (SELECT player_id FROM hitters WHERE season = %s) AS q1 '
+                     'JOIN (SELECT player_id FROM pitchers WHERE season = %s) AS q2 USING (player_id)')
+    assert args == ['2023', '2024']
+
+
+def test_create_query_reuses_plan_on_fresh_builders():
+    metrics_dict = {
+        'at_bats': DBMetric({'metric_name': 'at_bats', 'sql_value': 'SUM(at_bats) AS at_bats', 'is_totals_batter': 1}),
+        'hits': DBMetric({'metric_name': 'hits', 'sql_value': 'SUM(hits) AS hits', 'is_totals_batter': 1}),
+        'AVG': DBMetric({'metric_name': 'AVG', 'sql_value': 'SUM(hits) / SUM(at_bats) AS AVG',
+                         'is_totals_batter': 1, 'dependencies': 'hits,at_bats'}),
+    }
+    client = BaseballQueryClient()
+    client.cache = FakeCache(metrics_dict)
+    import asyncio
+    first = asyncio.run(client.create_query(['AVG', 'hits'], player_type='batter'))
+    first.add_year('2023')
+    second = asyncio.run(client.create_query(['AVG', 'hits'], player_type='batter'))
+    assert len(client.query_plans) == 1
+    assert second.get_metric_names() == ['hits', 'at_bats', 'AVG']
+    assert second.get_query() == 'SELECT SUM(hits) AS hits, SUM(at_bats) AS at_bats, SUM(hits) / SUM(at_bats) AS AVG FROM hitters'
+    assert second.get_args() == []
+
+
+def test_create_query_detects_dependency_cycles():
+    from baseball_query.errors import MetricDependencyError
+
+    metrics_dict = {
+        'a': DBMetric({'metric_name': 'a', 'sql_value': 'a', 'dependencies': 'b'}),
+        'b': DBMetric({'metric_name': 'b', 'sql_value': 'b', 'dependencies': 'a'}),
+    }
+    client = BaseballQueryClient()
+    client.cache = FakeCache(metrics_dict)
+    import asyncio
+    with pytest.raises(MetricDependencyError):
+        asyncio.run(client.create_query(['a'], player_type='batter'))
+
+
+def test_fetch_data_reports_stage_timings():
+    metrics_dict = {
+        'hits': DBMetric({'metric_name': 'hits', 'sql_value': 'hits', 'is_totals_batter': 1})
+    }
+    reports = []
+    client = BaseballQueryClient(on_fetch=reports.append)
+    client.db_manager = FakeDBManager([{'hits': 5}, {'hits': 3}])
+    client.cache = FakeCache(metrics_dict)
+    import asyncio
+    builder = asyncio.run(client.create_query(['hits'], player_type='batter'))
+    asyncio.run(client.fetch_data(builder, skip_processor=True))
+    assert len(reports) == 1
+    stats = reports[0].to_dict()
+    assert stats['builder'] == 'TotalsBuilder'
+    assert set(stats['timings']) == {'sql_execute', 'frame_build'}
+    assert stats['rows'] == {'query': 2}
+    assert stats['total'] >= stats['timings']['sql_execute']
+
+
+def test_fetch_many_deduplicates_and_keeps_order():
+    metrics_dict = {
+        'hits': DBMetric({'metric_name': 'hits', 'sql_value': 'hits', 'is_totals_batter': 1})
+    }
+    client = BaseballQueryClient()
+    client.db_manager = FakeDBManager([{'hits': 5}])
+    client.cache = FakeCache(metrics_dict)
+    import asyncio
+
+    async def run():
+        builders = []
+        for year in ('2023', '2024', '2023'):
+            builder = await client.create_query(['hits'], player_type='batter')
+            builders.append(builder.add_year(year))
+        return await client.fetch_many(builders, skip_processor=True)
+
+    first, second, third = asyncio.run(run())
+    assert [args for _, args in client.db_manager.queries] == [['2023'], ['2024']]
+    assert first.to_dict('records') == third.to_dict('records') == [{'hits': 5}]
+    assert first is not third
+
+
+def test_combined_query_rejects_overlapping_columns():
+    from baseball_query.async_db import DBManager
+    from baseball_query.queries import SingleQueryBuilder
+    from baseball_query.sql_query import SQLQuery
+
+    qb1 = SingleQueryBuilder('batter', SQLQuery())
+    qb1.set_table('hitters')
+    qb1.sql_query.add_select('player_id')
+    qb1.sql_query.add_select('SUM(games) AS games')
+
+    qb2 = SingleQueryBuilder('pitcher', SQLQuery())
+    qb2.set_table('pitchers')
+    qb2.sql_query.add_select('player_id')
+    qb2.sql_query.add_select('games')
+
+    with pytest.raises(ValueError, match='games'):
+        DBManager.combined_query(qb1, qb2, ['player_id'])
+
+
+def test_duplicate_result_columns_raise():
+    from baseball_query.frames import frame_from_columns
+
+    with pytest.raises(ValueError, match='games'):
+        frame_from_columns(['player_id', 'games', 'games'], [(1, 2, 3)])
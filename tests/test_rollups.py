@@ -0,0 +1,169 @@
+import asyncio
+from baseball_query.abc import DBMetric
+from baseball_query.queries import TotalsBuilder, PlaysBuilder
+from baseball_query.rollups import RollupManager
+
+
+class FakeCache:
+    """Metrics and schema of a hitters table with per plate appearance rows."""
+
+    def __init__(self):
+        self.metrics_dict = {
+            'player_id': DBMetric({'metric_name': 'player_id', 'sql_value': 'player_id', 'is_totals_batter': 1}),
+            'hits': DBMetric({'metric_name': 'hits', 'sql_value': 'SUM(hits) AS hits', 'is_totals_batter': 1,
+                              'is_additive': 1}),
+            'at_bats': DBMetric({'metric_name': 'at_bats', 'sql_value': 'SUM(at_bats) AS at_bats',
+                                 'is_totals_batter': 1, 'is_additive': 1}),
+            'AVG': DBMetric({'metric_name': 'AVG', 'sql_value': 'ROUND(SUM(hits) / SUM(at_bats), 3) AS AVG',
+                             'is_totals_batter': 1}),
+            'pa': DBMetric({'metric_name': 'pa', 'sql_value': 'COUNT(*) AS pa', 'is_totals_batter': 1}),
+            'hit_rate': DBMetric({'metric_name': 'hit_rate', 'sql_value': 'SUM(IF(hits > 0, 1, 0)) AS hit_rate',
+                                  'is_totals_batter': 1}),
+        }
+
+    async def get_metrics_dict(self):
+        return self.metrics_dict
+
+    async def get_table_columns_dict(self):
+        return {'hitters': ['player_id', 'name', 'season', 'official_date', 'hits', 'at_bats', 'launch_speed']}
+
+
+def make_builder(metrics, dates=('2024-05-01', '2024-05-15')):
+    cache = FakeCache()
+    builder = TotalsBuilder('batter')
+    builder.group_by('player_id')
+    for metric in metrics:
+        builder.add_select(cache.metrics_dict[metric])
+    builder.add_year('2024')
+    builder.add_dates(dates)
+    return builder
+
+
+def test_rewrites_eligible_date_range_queries():
+    rollups = RollupManager(None, FakeCache(), ttl=float('inf'))
+    rollups.coverage['hitters'] = [('2024-04-01', '2024-05-31')]
+
+    async def rewrite(builder):
+        return await rollups.rewrite(builder)
+
+    builder = make_builder(['player_id', 'hits', 'AVG'])
+    rewritten = asyncio.run(rewrite(builder))
+    assert rewritten.get_query() == builder.get_query().replace('FROM hitters ', 'FROM hitters_daily ')
+    assert rewritten.get_args() == ['2024', '2024-05-01', '2024-05-15']
+    assert builder.get_query().startswith('SELECT player_id, SUM(hits) AS hits')
+    for ineligible in (make_builder(['player_id', 'pa']), make_builder(['player_id', 'hit_rate']),
+                       make_builder(['player_id', 'hits'], ('2024-03-01', '2024-05-15')),
+                       make_builder(['player_id', 'hits'], None), PlaysBuilder('batter')):
+        assert asyncio.run(rewrite(ineligible)) is ineligible
+
+
+def test_refresh_statements():
+    class FakeDB:
+        def __init__(self):
+            self.updates = []
+            self.transactions = []
+
+        async def fetch_table_schema(self, tables):
+            return []
+
+        async def execute_update(self, query, params=None):
+            self.updates.append((query, params))
+            return 0
+
+        async def execute_transaction(self, statements):
+            self.transactions.append(statements)
+            return [2, 3, 1]
+
+    db = FakeDB()
+    rollups = RollupManager(db, FakeCache())
+    assert asyncio.run(rollups.refresh('hitters', '2024-05-01', '2024-05-02')) == 3
+    select = 'player_id, name, season, official_date, SUM(hits) AS hits, SUM(at_bats) AS at_bats'
+    group_by = 'player_id, name, season, official_date'
+    version = 'COUNT(*) AS row_count, ROUND(COALESCE(SUM(hits), 0) + COALESCE(SUM(at_bats), 0), 3) AS total'
+    assert db.updates == [
+        ('CREATE TABLE IF NOT EXISTS rollup_ranges (table_name VARCHAR(64), start_date DATE, end_date DATE, '
+         'row_count BIGINT, total DOUBLE)', None),
+        (f'CREATE TABLE hitters_daily AS SELECT {select} FROM hitters WHERE 1 = 0 GROUP BY {group_by}', None),
+        ('CREATE INDEX idx_hitters_daily ON hitters_daily (player_id, official_date)', None),
+    ]
+    assert db.transactions == [[
+        ('DELETE FROM hitters_daily WHERE official_date BETWEEN %s AND %s', ['2024-05-01', '2024-05-02']),
+        ('INSERT INTO hitters_daily (player_id, name, season, official_date, hits, at_bats) '
+         f'SELECT {select} FROM hitters WHERE official_date BETWEEN %s AND %s GROUP BY {group_by}',
+         ['2024-05-01', '2024-05-02']),
+        ('DELETE FROM rollup_ranges WHERE table_name = %s AND start_date >= %s AND end_date <= %s',
+         ['hitters', '2024-05-01', '2024-05-02']),
+        ('INSERT INTO rollup_ranges (table_name, start_date, end_date, row_count, total) '
+         f'SELECT %s, %s, %s, {version} FROM hitters WHERE official_date BETWEEN %s AND %s',
+         ['hitters', '2024-05-01', '2024-05-02', '2024-05-01', '2024-05-02']),
+    ]]
+
+
+def test_coverage_is_the_union_of_refreshed_ranges():
+    rollups = RollupManager(None, FakeCache(), ttl=float('inf'))
+    rollups.coverage['hitters'] = RollupManager.merge_ranges(
+        [('2024-06-01', '2024-06-30'), ('2024-04-01', '2024-04-30'), ('2024-05-01', '2024-05-10')])
+    assert rollups.coverage['hitters'] == [('2024-04-01', '2024-05-10'), ('2024-06-01', '2024-06-30')]
+    assert rollups.covers('hitters', '2024-04-15', '2024-05-10')
+    assert not rollups.covers('hitters', '2024-05-01', '2024-05-15')
+    builder = make_builder(['player_id', 'hits'], ('2024-05-11', '2024-06-05'))
+    assert asyncio.run(rollups.rewrite(builder)) is builder
+
+
+def test_constants_inside_sums_are_not_eligible():
+    dimensions, additive = {'player_id', 'official_date'}, {'hits', 'at_bats'}
+    assert RollupManager._check_expression('SUM(hits + at_bats) - SUM(at_bats)', dimensions, additive)
+    assert not RollupManager._check_expression('SUM(1)', dimensions, additive)
+    assert not RollupManager._check_expression('SUM(hits + 1)', dimensions, additive)
+    builder = TotalsBuilder('batter')
+    builder.sql_query.add_select('SUM(1) AS games')
+    assert not RollupManager.check_query(builder, dimensions, additive)
+
+
+class RangesDB:
+    """rollup_ranges rows and the current version of the raw rows of each range."""
+
+    def __init__(self, ranges, versions):
+        self.ranges = ranges
+        self.versions = versions
+        self.loads = 0
+
+    async def fetch_table_schema(self, tables):
+        return [{'table_name': 'rollup_ranges', 'column_name': column}
+                for column in ('table_name', 'start_date', 'end_date', 'row_count', 'total')]
+
+    async def fetch_all(self, query, params=None):
+        if query.startswith('SELECT table_name'):
+            self.loads += 1
+            return self.ranges
+        return [self.versions[tuple(params)]]
+
+
+def test_ranges_with_changed_raw_rows_are_not_covered():
+    ranges = [{'table_name': 'hitters', 'start_date': '2024-04-01', 'end_date': '2024-04-30', 'row_count': 10,
+               'total': 25.0},
+              {'table_name': 'hitters', 'start_date': '2024-05-01', 'end_date': '2024-05-31', 'row_count': 12,
+               'total': 30.0},
+              {'table_name': 'hitters', 'start_date': '2024-06-01', 'end_date': '2024-06-30', 'row_count': None,
+               'total': None}]
+    versions = {('2024-04-01', '2024-04-30'): {'row_count': 10, 'total': 25.0},
+                # A play inserted after the refresh
+                ('2024-05-01', '2024-05-31'): {'row_count': 13, 'total': 32.0},
+                ('2024-06-01', '2024-06-30'): {'row_count': 9, 'total': 20.0}}
+    rollups = RollupManager(RangesDB(ranges, versions), FakeCache(), tables=('hitters',))
+    asyncio.run(rollups.load_coverage())
+    assert rollups.coverage['hitters'] == [('2024-04-01', '2024-04-30')]
+
+
+def test_coverage_reloaded_after_ttl():
+    db = RangesDB([{'table_name': 'hitters', 'start_date': '2024-05-01', 'end_date': '2024-05-31', 'row_count': 3,
+                    'total': 7.0}], {('2024-05-01', '2024-05-31'): {'row_count': 3, 'total': 7.0}})
+    rollups = RollupManager(db, FakeCache(), tables=('hitters',), ttl=3600)
+    builder = make_builder(['player_id', 'hits'])
+    assert asyncio.run(rollups.rewrite(builder)) is not builder
+    assert asyncio.run(rollups.rewrite(builder)) is not builder
+    assert db.loads == 1
+    db.versions[('2024-05-01', '2024-05-31')] = {'row_count': 4, 'total': 9.0}
+    rollups.loaded_at['hitters'] -= 3600
+    assert asyncio.run(rollups.rewrite(builder)) is builder
+    assert db.loads == 2
@@ -31,3 +31,28 @@ def test_base_str_sql_query_parsing():
     built = q.build_query()
     expected = base + ' WHERE a = %s GROUP BY a'
     assert built == expected
+
+
+def test_same_shape_shares_rendered_sql():
+    def shaped():
+        q = SQLQuery()
+        q.add_select('hits').set_from_table('all_plays')
+        q.add_where('batter_id = %s')
+        return q
+
+    first, second = shaped(), shaped()
+    assert first.build_query() is second.build_query()
+    assert first.copy().build_query() is first.build_query()
+
+
+def test_rendered_sql_invalidated_by_changes():
+    q = SQLQuery()
+    q.add_select('hits').set_from_table('hitters')
+    assert q.build_query() == 'SELECT hits FROM hitters'
+    q.add_select('hits')
+    q.add_order_by('hits')
+    assert q.build_query() == 'SELECT hits FROM hitters ORDER BY hits'
+    q.select = ['name']
+    assert q.build_query() == 'SELECT name FROM hitters ORDER BY hits'
+    q.add_select('name')
+    assert q.select == ['name']
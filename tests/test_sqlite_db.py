@@ -0,0 +1,72 @@
+import asyncio
+import sqlite3
+from baseball_query.sqlite_db import SQLiteDBManager, to_sqlite_sql
+from baseball_query.queries import TotalsBuilder
+from baseball_query.abc import DBMetric
+
+
+def make_snapshot(path):
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE hitters (player_id INTEGER, name TEXT, season TEXT, hits INTEGER, '
+                       'at_bats INTEGER)')
+    connection.executemany('INSERT INTO hitters VALUES (?, ?, ?, ?, ?)',
+                           [(1, 'A', '2024', 3, 10), (1, 'A', '2024', 2, 5), (2, 'B', '2024', 0, 4)])
+    connection.commit()
+    connection.close()
+
+
+def test_to_sqlite_sql():
+    assert to_sqlite_sql("SELECT SUM(h) / SUM(ab) FROM t WHERE d LIKE '1/%%' AND s = %s") == \
+        "SELECT SUM(h) * 1.0 / SUM(ab) FROM t WHERE d LIKE '1/%' AND s = ?"
+
+
+def test_runs_builder_sql_on_snapshot(tmp_path):
+    path = str(tmp_path / 'stats.sqlite')
+    make_snapshot(path)
+    builder = TotalsBuilder('batter')
+    for data in ({'metric_name': 'player_id', 'sql_value': 'player_id', 'is_totals_batter': 1},
+                 {'metric_name': 'AVG', 'sql_value': 'SUM(hits) / SUM(at_bats) AS AVG', 'is_totals_batter': 1},
+                 {'metric_name': 'qualified', 'sql_value': "IF(SUM(at_bats) > 5, 'y', 'n') AS qualified",
+                  'is_totals_batter': 1}):
+        builder.add_select(DBMetric(data))
+    builder.group_by('player_id').order_by('player_id').add_year('2024')
+    db = SQLiteDBManager(path)
+
+    async def run():
+        try:
+            rows = await db.fetch_all(builder.get_query(), builder.get_args())
+            schema = await db.fetch_table_schema(['hitters'])
+            checksum = await db.get_table_checksum('hitters')
+        finally:
+            await db.close()
+        return rows, schema, checksum
+
+    rows, schema, checksum = asyncio.run(run())
+    assert rows == [{'player_id': 1, 'AVG': 5 / 15, 'qualified': 'y'}, {'player_id': 2, 'AVG': 0.0, 'qualified': 'n'}]
+    assert schema[0] == {'table_name': 'hitters', 'column_name': 'player_id', 'data_type': 'integer'}
+    assert checksum == '3:3'
+
+
+def test_named_params_bind_by_name(tmp_path):
+    path = str(tmp_path / 'stats.sqlite')
+    make_snapshot(path)
+    assert to_sqlite_sql("SELECT name FROM hitters WHERE season = %(season)s AND name LIKE 'A%%'") == \
+        "SELECT name FROM hitters WHERE season = :season AND name LIKE 'A%'"
+    db = SQLiteDBManager(path, read_only=False)
+
+    async def run():
+        try:
+            updated = await db.execute_update('UPDATE hitters SET hits = %(hits)s WHERE player_id = %(player_id)s',
+                                              {'player_id': 2, 'hits': 1})
+            counts = await db.execute_transaction([
+                ('DELETE FROM hitters WHERE player_id = %(player_id)s AND at_bats = %(at_bats)s',
+                 {'at_bats': 5, 'player_id': 1})])
+            rows = await db.fetch_all('SELECT player_id, SUM(hits) AS hits FROM hitters WHERE season = %(season)s '
+                                      'GROUP BY player_id ORDER BY player_id', {'season': '2024'})
+        finally:
+            await db.close()
+        return updated, counts, rows
+
+    updated, counts, rows = asyncio.run(run())
+    assert updated == 1 and counts == [1]
+    assert rows == [{'player_id': 1, 'hits': 3}, {'player_id': 2, 'hits': 1}]
@@ -0,0 +1,26 @@
+import pytest
+from benchmarks.synthetic import generate_tables, InMemoryDBManager
+
+
+def test_in_memory_where_filters_match_generated_rows():
+    tables = generate_tables(players=12, plays_per_player=5)
+    db = InMemoryDBManager(tables)
+    hitters = tables['hitters']
+
+    rows = db.execute('SELECT player_id, SUM(hits) AS hits FROM hitters WHERE season = %s AND team_name = %s '
+                      'GROUP BY player_id', ['2024', 'BOS'])
+    assert [row['player_id'] for row in rows] == [row['player_id'] for row in hitters if row['team_name'] == 'BOS']
+    assert rows[0]['hits'] == next(row['hits'] for row in hitters if row['team_name'] == 'BOS')
+
+    rows = db.execute('SELECT hit_speeds FROM all_plays WHERE batter_id IN (%s, %s) AND season = %s', [3, 7, '2024'])
+    assert len(rows) == 10
+
+    rows = db.execute('SELECT player_id FROM hitters WHERE player_id BETWEEN %s AND %s', [4, 6])
+    assert [row['player_id'] for row in rows] == [4, 5, 6]
+    assert db.execute('SELECT player_id FROM hitters WHERE player_id = 99', []) == []
+
+
+def test_in_memory_rejects_unsupported_where_clauses():
+    db = InMemoryDBManager(generate_tables(players=2, plays_per_player=1))
+    with pytest.raises(ValueError, match='Unsupported'):
+        db.execute('SELECT player_id FROM hitters WHERE player_id > %s', [1])